@@ -0,0 +1,492 @@
+﻿from __future__ import annotations
+
+import os
+import threading
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, Mapping
+
+import numpy as np
+import pandas as pd
+
+from panel import FundPanel
+from storage import BASE_DATA_DIR, parse_date_key
+
+ANALYTICS_DIR = BASE_DATA_DIR / "analytics"
+CORRELATION_MIN_PERIODS = 3
+# Trailing calendar windows, in months, ending at the latest panel date.
+RISK_WINDOWS = (("1M", 1), ("3M", 3), ("1Y", 12))
+RISK_MIN_RETURNS = 3
+RISK_METRICS = ("vol", "max_drawdown", "sharpe", "hit_ratio")
+PERIODS_PER_YEAR = {"quotidien": 252, "hebdomadaire": 52}
+# Money-market rates accrue on an actual/360 basis.
+RATE_DAY_COUNT = 360
+# Precomputed with every panel update, besides YTD and since the first archived VL.
+RETURN_HORIZONS = (
+    ("1M", pd.DateOffset(months=1)),
+    ("3M", pd.DateOffset(months=3)),
+    ("6M", pd.DateOffset(months=6)),
+    ("1Y", pd.DateOffset(years=1)),
+)
+
+_sums_lock = threading.Lock()
+_sums_memo: dict[str, "CorrelationSums"] = {}
+_returns_lock = threading.Lock()
+_returns_memo: dict[str, tuple[dict[str, str], pd.DataFrame]] = {}
+
+
+def _aligned(matrix: pd.DataFrame, series: pd.Series) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    x = matrix.to_numpy(dtype="float64")
+    y = np.broadcast_to(series.reindex(matrix.columns).to_numpy(dtype="float64"), x.shape)
+    mask = ~np.isnan(x) & ~np.isnan(y)
+    return np.where(mask, x, 0.0), np.where(mask, y, 0.0), mask
+
+
+def correlate_rows(
+    matrix: pd.DataFrame, series: pd.Series, min_periods: int = CORRELATION_MIN_PERIODS
+) -> pd.DataFrame:
+    """Pearson correlation of every row of `matrix` with `series`, over the columns both have.
+
+    Missing values are handled pairwise: each row uses its own common dates. `corr` is NaN when
+    fewer than `min_periods` dates are shared or either side is constant on them.
+    """
+    x, y, mask = _aligned(matrix, series)
+    periods = mask.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dx = np.where(mask, x - (x.sum(axis=1) / periods)[:, None], 0.0)
+        dy = np.where(mask, y - (y.sum(axis=1) / periods)[:, None], 0.0)
+        corr = (dx * dy).sum(axis=1) / np.sqrt((dx * dx).sum(axis=1) * (dy * dy).sum(axis=1))
+    corr = np.clip(corr, -1.0, 1.0)
+    corr[periods < max(min_periods, 2)] = np.nan
+    return pd.DataFrame({"corr": corr, "periods": periods}, index=matrix.index)
+
+
+def rolling_correlate_rows(
+    matrix: pd.DataFrame, series: pd.Series, window: int, min_periods: int = CORRELATION_MIN_PERIODS
+) -> pd.DataFrame:
+    """Trailing-window `correlate_rows`: column d is the correlation over the `window` columns ending at d.
+
+    Columns are date keys in any catalog format and order; the result has them in
+    chronological order, without the ones that are not dates. Window sums come from running
+    totals, so the whole grid costs a few passes over the matrix.
+    """
+    matrix, _ = _dated_columns(matrix)
+    x, y, mask = _aligned(matrix, series)
+    # Correlation ignores shifts; centring first keeps the running totals small.
+    count = np.maximum(mask.sum(axis=1), 1)[:, None]
+    x = np.where(mask, x - x.sum(axis=1)[:, None] / count, 0.0)
+    y = np.where(mask, y - y.sum(axis=1)[:, None] / count, 0.0)
+
+    def windowed(values: np.ndarray) -> np.ndarray:
+        totals = np.cumsum(values, axis=1)
+        totals[:, window:] = totals[:, window:] - totals[:, :-window]
+        return totals
+
+    corr = _correlation_from_sums(
+        windowed(mask.astype("float64")),
+        windowed(x),
+        windowed(y),
+        windowed(x * x),
+        windowed(y * y),
+        windowed(x * y),
+        min_periods,
+    )
+    return pd.DataFrame(corr, index=matrix.index, columns=matrix.columns)
+
+
+def _correlation_from_sums(
+    n: np.ndarray,
+    sx: np.ndarray,
+    sy: np.ndarray,
+    sxx: np.ndarray,
+    syy: np.ndarray,
+    sxy: np.ndarray,
+    min_periods: int,
+) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = sxy - sx * sy / n
+        var_x = sxx - sx * sx / n
+        var_y = syy - sy * sy / n
+        corr = np.clip(cov / np.sqrt(var_x * var_y), -1.0, 1.0)
+    # Differences of sums leave rounding residue where a side is constant; treat it as no variance.
+    corr[(var_x <= 1e-12 * sxx) | (var_y <= 1e-12 * syy) | (n < max(min_periods, 2))] = np.nan
+    return corr
+
+
+@dataclass
+class CorrelationSums:
+    """Running n, Σx, Σy, Σx², Σy², Σxy of each fund's values against one series.
+
+    Values are shifted by the first one seen (per fund for x) so the sums stay small next to
+    their spread. `dates` records what has been folded in, as date -> (panel source, y), and
+    `unmatched` the panel dates still waiting for a series value. `generation`, `row_mark`
+    and `panel_dates` are the panel watermarks of the last update, `series_mark` the one of
+    the series changes (see update_correlation_sums).
+    """
+
+    isins: list[str] = field(default_factory=list)
+    dates: dict[str, tuple[str, float]] = field(default_factory=dict)
+    unmatched: set[str] = field(default_factory=set)
+    shift_x: np.ndarray = field(default_factory=lambda: np.zeros(0))
+    shift_y: float = np.nan
+    sums: np.ndarray = field(default_factory=lambda: np.zeros((6, 0)))
+    generation: int = -1
+    row_mark: int = 0
+    panel_dates: int = 0
+    series_mark: str = ""
+
+    def correlations(self, min_periods: int = CORRELATION_MIN_PERIODS) -> pd.DataFrame:
+        corr = _correlation_from_sums(*self.sums, min_periods)
+        return pd.DataFrame(
+            {"corr": corr, "periods": self.sums[0].astype("int64")}, index=pd.Index(self.isins, name="isin")
+        )
+
+    def _grow(self, isins: list[str]) -> None:
+        extra = len(isins) - len(self.isins)
+        self.isins = list(isins)
+        self.shift_x = np.concatenate([self.shift_x, np.full(extra, np.nan)])
+        self.sums = np.concatenate([self.sums, np.zeros((6, extra))], axis=1)
+
+    def _fold(self, date_key: str, source: str, x: np.ndarray, y: float) -> None:
+        ok = ~np.isnan(x)
+        if np.isnan(self.shift_y):
+            self.shift_y = y
+        first = ok & np.isnan(self.shift_x)
+        self.shift_x[first] = x[first]
+        dx = np.where(ok, x - self.shift_x, 0.0)
+        dy = np.where(ok, y - self.shift_y, 0.0)
+        self.sums += np.stack([ok.astype("float64"), dx, dy, dx * dx, dy * dy, dx * dy])
+        self.dates[date_key] = (source, y)
+
+
+def _series_value(series: Mapping[str, float], date_key: str) -> float | None:
+    value = series.get(date_key)
+    if value is None or not np.isfinite(value):
+        return None
+    return float(value)
+
+
+def update_correlation_sums(
+    sums: CorrelationSums,
+    panel: FundPanel,
+    series: Mapping[str, float],
+    layer: str = "performance_num",
+    series_changes: Callable[[str], tuple[Iterable[str], str]] | None = None,
+) -> tuple[CorrelationSums, bool]:
+    """Fold in panel dates not yet counted, O(funds) per new date; returns the sums and whether they changed.
+
+    Only the dates the panel appended since the last update and those still unmatched are
+    looked up in `series`. Series values that change on already folded dates are found through
+    `series_changes(mark) -> (dates, new mark)`, or by checking every folded date without it.
+    A replaced or removed date cannot be taken back out of the sums, so that case starts over;
+    so does a new panel generation, whose rows no longer line up with the watermark.
+    """
+    mark = sums.series_mark
+    if series_changes is None:
+        touched: Iterable[str] = list(sums.dates)
+    else:
+        touched, mark = series_changes(sums.series_mark)
+
+    if sums.generation != panel.generation:
+        sums, changed = _refold(sums, panel, series, layer), True
+    else:
+        new_dates = panel.dates_since(sums.row_mark)
+        added = sum(1 for d in new_dates if d not in sums.unmatched)
+        stale = (
+            any(d in sums.dates for d in new_dates)
+            or len(panel.index) != sums.panel_dates + added
+            or any(d in sums.dates and _series_value(series, d) != sums.dates[d][1] for d in touched)
+        )
+        if stale:
+            sums, changed = _refold(CorrelationSums(), panel, series, layer), True
+        else:
+            changed = _fold_dates(sums, panel, series, layer, sums.unmatched.union(new_dates))
+    marks = (panel.row_count, len(panel.index), mark)
+    changed = changed or marks != (sums.row_mark, sums.panel_dates, sums.series_mark)
+    sums.row_mark, sums.panel_dates, sums.series_mark = marks
+    return sums, changed
+
+
+def _refold(sums: CorrelationSums, panel: FundPanel, series: Mapping[str, float], layer: str) -> CorrelationSums:
+    # Full check against every panel date; only needed once per panel generation.
+    current = all(
+        d in panel.index and panel.sources.get(d, "") == src and _series_value(series, d) == y
+        for d, (src, y) in sums.dates.items()
+    )
+    if not current or panel.isins[: len(sums.isins)] != sums.isins:
+        sums = CorrelationSums()
+    sums.generation = panel.generation
+    sums.unmatched = set()
+    _fold_dates(sums, panel, series, layer, [d for d in panel.index if d not in sums.dates])
+    return sums
+
+
+def _fold_dates(
+    sums: CorrelationSums, panel: FundPanel, series: Mapping[str, float], layer: str, candidates: Iterable[str]
+) -> bool:
+    changed = False
+    if len(panel.isins) > len(sums.isins):
+        sums._grow(panel.isins)
+        changed = True
+    width = len(sums.isins)
+    for date_key in sorted(candidates):
+        y = _series_value(series, date_key)
+        if y is None:
+            sums.unmatched.add(date_key)
+            continue
+        row = panel.index[date_key]
+        x = np.where(panel.present[row, :width].astype(bool), panel.layers[layer][row, :width], np.nan)
+        sums._fold(date_key, panel.sources.get(date_key, ""), x, y)
+        sums.unmatched.discard(date_key)
+        changed = True
+    return changed
+
+
+def _sums_path(name: str) -> Path:
+    return ANALYTICS_DIR / f"{name}.npz"
+
+
+def _read_sums(name: str) -> CorrelationSums:
+    try:
+        with np.load(_sums_path(name), allow_pickle=False) as saved:
+            return CorrelationSums(
+                isins=saved["isins"].tolist(),
+                dates={
+                    d: (src, float(y))
+                    for d, src, y in zip(saved["dates"].tolist(), saved["sources"].tolist(), saved["values"])
+                },
+                unmatched=set(saved["unmatched"].tolist()),
+                shift_x=saved["shift_x"],
+                shift_y=float(saved["shift_y"]),
+                sums=saved["sums"],
+                generation=int(saved["marks"][0]),
+                row_mark=int(saved["marks"][1]),
+                panel_dates=int(saved["marks"][2]),
+                series_mark=str(saved["series_mark"]),
+            )
+    except (OSError, KeyError, ValueError):
+        return CorrelationSums()
+
+
+def _write_sums(name: str, sums: CorrelationSums) -> None:
+    path = _sums_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    dates = list(sums.dates)
+    with tmp_path.open("wb") as fh:
+        np.savez(
+            fh,
+            isins=np.asarray(sums.isins, dtype=str),
+            dates=np.asarray(dates, dtype=str),
+            sources=np.asarray([sums.dates[d][0] for d in dates], dtype=str),
+            values=np.asarray([sums.dates[d][1] for d in dates], dtype="float64"),
+            unmatched=np.asarray(sorted(sums.unmatched), dtype=str),
+            shift_x=sums.shift_x,
+            shift_y=np.float64(sums.shift_y),
+            sums=sums.sums,
+            marks=np.asarray([sums.generation, sums.row_mark, sums.panel_dates], dtype="int64"),
+            series_mark=np.asarray(sums.series_mark, dtype=str),
+        )
+    os.replace(tmp_path, path)
+
+
+def series_correlations(
+    name: str,
+    panel: FundPanel,
+    series: Mapping[str, float],
+    min_periods: int = CORRELATION_MIN_PERIODS,
+    series_changes: Callable[[str], tuple[Iterable[str], str]] | None = None,
+) -> pd.DataFrame:
+    """Correlation of every panel fund with `series`, from persisted running sums kept under `name`."""
+    with _sums_lock:
+        sums = _sums_memo.get(name)
+        if sums is None:
+            sums = _read_sums(name)
+        sums, changed = update_correlation_sums(sums, panel, series, series_changes=series_changes)
+        if changed:
+            _write_sums(name, sums)
+        _sums_memo[name] = sums
+        return sums.correlations(min_periods)
+
+
+def _ffill(values: np.ndarray) -> np.ndarray:
+    # Forward fill along dates (axis 1); leading gaps stay NaN.
+    idx = np.where(np.isnan(values), 0, np.arange(values.shape[1]))
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    return np.take_along_axis(values, idx, axis=1)
+
+
+def _previous(values: np.ndarray) -> np.ndarray:
+    # Last observed value strictly before each date.
+    out = np.full(values.shape, np.nan)
+    out[:, 1:] = _ffill(values)[:, :-1]
+    return out
+
+
+def _std(values: np.ndarray, count: np.ndarray) -> np.ndarray:
+    mask = ~np.isnan(values)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(mask, values, 0.0).sum(axis=1) / count
+        dev = np.where(mask, values - mean[:, None], 0.0)
+        return np.sqrt((dev * dev).sum(axis=1) / (count - 1))
+
+
+def _dated_columns(frame: pd.DataFrame) -> tuple[pd.DataFrame, pd.DatetimeIndex]:
+    """`frame` with its date-key columns in chronological order, and their dates; other columns are dropped."""
+    parsed = ((parse_date_key(str(col)), col) for col in frame.columns)
+    dated = sorted(((when, col) for when, col in parsed if when is not None), key=lambda item: item[0])
+    return frame[[col for _, col in dated]], pd.DatetimeIndex([when for when, _ in dated])
+
+
+def risk_metrics(vl: pd.DataFrame, short_rate: dict[str, float], periods_per_year: int) -> pd.DataFrame:
+    """Volatility, max drawdown, Sharpe ratio and hit ratio of every fund over RISK_WINDOWS.
+
+    `vl` holds funds as rows and date keys as columns, in any catalog format and order. A
+    fund's return at a date runs from its previous observed VL, so missing dates stretch a
+    return rather than break it. Sharpe uses the excess over `short_rate` (annual, by date
+    key), taken as of each date and accrued over the days the return spans. Columns are
+    named `<metric>_<window>`.
+    """
+    vl, dates = _dated_columns(vl)
+    values = vl.to_numpy(dtype="float64", copy=True)
+    values[~(values > 0)] = np.nan
+    out = pd.DataFrame(index=vl.index)
+    if values.shape[1] == 0:
+        for metric in RISK_METRICS:
+            for label, _ in RISK_WINDOWS:
+                out[f"{metric}_{label}"] = np.nan
+        return out
+
+    days = (dates.to_numpy(dtype="datetime64[D]") - np.datetime64("1970-01-01", "D")).astype("float64")
+    returns = values / _previous(values) - 1.0
+    span = days[None, :] - _previous(np.where(np.isnan(values), np.nan, days[None, :]))
+
+    rates = pd.Series(
+        list(short_rate.values()), index=pd.DatetimeIndex([parse_date_key(str(k)) for k in short_rate]), dtype="float64"
+    )
+    rates = rates[rates.index.notna()].sort_index()
+    rates = rates[~rates.index.duplicated(keep="last")]
+    rate_asof = rates.reindex(dates, method="ffill").to_numpy() if len(rates) else np.full(len(dates), np.nan)
+    excess = returns - rate_asof[None, :] * span / RATE_DAY_COUNT
+
+    annualise = np.sqrt(periods_per_year)
+    for label, months in RISK_WINDOWS:
+        in_window = np.asarray(dates > dates[-1] - pd.DateOffset(months=months))
+        r = np.where(in_window, returns, np.nan)
+        n = (~np.isnan(r)).sum(axis=1)
+        vol = _std(r, n) * annualise
+        vol[n < RISK_MIN_RETURNS] = np.nan
+
+        ex = np.where(in_window, excess, np.nan)
+        n_ex = (~np.isnan(ex)).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sharpe = np.nansum(ex, axis=1) / n_ex / _std(ex, n_ex) * annualise
+            hit = (r > 0).sum(axis=1) / n
+        sharpe[(n_ex < RISK_MIN_RETURNS) | ~np.isfinite(sharpe)] = np.nan
+        hit[n < RISK_MIN_RETURNS] = np.nan
+
+        path = _ffill(np.where(in_window, values, np.nan))
+        drawdown = path / np.fmax.accumulate(path, axis=1) - 1.0
+        max_drawdown = np.fmin.reduce(drawdown, axis=1)
+        max_drawdown[n < RISK_MIN_RETURNS] = np.nan
+
+        out[f"vol_{label}"] = vol
+        out[f"max_drawdown_{label}"] = max_drawdown
+        out[f"sharpe_{label}"] = sharpe
+        out[f"hit_ratio_{label}"] = hit
+    return out[[f"{metric}_{label}" for metric in RISK_METRICS for label, _ in RISK_WINDOWS]]
+
+
+def horizon_returns(
+    vl: pd.DataFrame,
+    horizons: tuple[tuple[str, pd.DateOffset], ...] = RETURN_HORIZONS,
+    as_of: str | None = None,
+) -> pd.DataFrame:
+    """Return of every fund over each horizon ending at `as_of` (default: the latest date).
+
+    Both ends are taken as of their date: the last VL observed on or before it, so a fund
+    missing from a file still gets a value, but never one from a later date. Besides
+    `return_<label>` per horizon, adds `return_YTD` (from the last VL of the previous year)
+    and `return_origin` (from the first archived VL). Columns of `vl` are date keys in any
+    catalog format; keys that are not dates are ignored.
+    """
+    columns = [f"return_{label}" for label, _ in horizons] + ["return_YTD", "return_origin"]
+    vl, dates = _dated_columns(vl)
+    values = vl.to_numpy(dtype="float64", copy=True)
+    values[~(values > 0)] = np.nan
+    if as_of is None:
+        end = len(dates) - 1
+    else:
+        as_of_date = parse_date_key(as_of)
+        end = -1 if as_of_date is None else int(dates.searchsorted(as_of_date, side="right")) - 1
+    if end < 0:
+        return pd.DataFrame(np.nan, index=vl.index, columns=columns)
+
+    filled = _ffill(values)
+    last = filled[:, end]
+
+    def base(target: pd.Timestamp) -> np.ndarray:
+        col = int(dates.searchsorted(target, side="right")) - 1
+        return filled[:, col] if col >= 0 else np.full(len(values), np.nan)
+
+    observed = ~np.isnan(values[:, : end + 1])
+    first = values[np.arange(len(values)), observed.argmax(axis=1)]
+    bases = [base(dates[end] - offset) for _, offset in horizons]
+    bases.append(base(pd.Timestamp(dates[end].year - 1, 12, 31)))
+    bases.append(np.where(observed.any(axis=1), first, np.nan))
+    return pd.DataFrame(
+        np.column_stack([last / b - 1.0 for b in bases]), index=vl.index, columns=columns
+    )
+
+
+def _returns_path(frequency: str) -> Path:
+    return ANALYTICS_DIR / f"{frequency}.returns.npz"
+
+
+def _read_returns(frequency: str) -> tuple[dict[str, str], pd.DataFrame] | None:
+    try:
+        with np.load(_returns_path(frequency), allow_pickle=False) as saved:
+            sources = dict(zip(saved["dates"].tolist(), saved["sources"].tolist()))
+            table = pd.DataFrame(
+                saved["values"],
+                index=pd.Index(saved["isins"].tolist(), name="isin"),
+                columns=saved["columns"].tolist(),
+            )
+            return sources, table
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _write_returns(frequency: str, sources: dict[str, str], table: pd.DataFrame) -> None:
+    path = _returns_path(frequency)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    with tmp_path.open("wb") as fh:
+        np.savez(
+            fh,
+            dates=np.asarray(list(sources), dtype=str),
+            sources=np.asarray(list(sources.values()), dtype=str),
+            isins=np.asarray(table.index.tolist(), dtype=str),
+            columns=np.asarray(table.columns.tolist(), dtype=str),
+            values=table.to_numpy(dtype="float64"),
+        )
+    os.replace(tmp_path, path)
+
+
+def fund_returns(panel: FundPanel, isins: set[str] | None = None) -> pd.DataFrame:
+    """`horizon_returns` at the panel's latest date, persisted per panel content.
+
+    Computed once after each ingest; later callers read the stored table and never touch the
+    VL matrix or the workbooks.
+    """
+    with _returns_lock:
+        saved = _returns_memo.get(panel.frequency)
+        if saved is None or saved[0] != panel.sources:
+            saved = _read_returns(panel.frequency)
+        if saved is None or saved[0] != panel.sources:
+            saved = (dict(panel.sources), horizon_returns(panel.matrix("vl_num")))
+            _write_returns(panel.frequency, *saved)
+        _returns_memo[panel.frequency] = saved
+    table = saved[1]
+    return table[table.index.isin(isins)] if isins is not None else table.copy()
@@ -1,18 +1,32 @@
 from __future__ import annotations
 
 import base64
+from collections.abc import Iterator, Mapping
 from datetime import date, datetime, timedelta
 from io import BytesIO
 import math
 from pathlib import Path
-import re
-import unicodedata
 
+import numpy as np
 import pandas as pd
 import streamlit as st
+from analytics import (
+    CORRELATION_MIN_PERIODS,
+    PERIODS_PER_YEAR,
+    RISK_METRICS,
+    RISK_WINDOWS,
+    fund_returns,
+    risk_metrics,
+    rolling_correlate_rows,
+    series_correlations,
+)
+from panel import load_panel
+from parse_cache import cached, clear_memory_caches, memory_cache, memory_cache_entries, memory_cache_stats
+from parsers import BAM_CURVE_SCHEMA_VERSION, NUMERIC_COLUMNS, norm_col, parse_bam_curve, to_num, to_num_series
 from vba_finance import (
     DatePr_Cp,
     DateSerial,
+    YieldCurve,
     calcul_taux,
     mati,
     prix_amortissable,
@@ -21,13 +35,17 @@ from vba_finance import (
 from storage import (
     add_asfim_files,
     add_bam_files,
-    get_asfim_records,
-    get_bam_records,
+    bam_dates_since,
+    history_version,
     init_storage,
+    latest_asfim_record,
+    latest_bam_record,
     list_asfim_dates,
     list_asfim_files,
     list_bam_dates,
     list_bam_files,
+    load_asfim_table,
+    record_content_hash,
     summarize_asfim_history,
     summarize_bam_history,
 )
@@ -497,46 +515,8 @@ def _render_brand_header() -> None:
 _inject_theme()
 
 
-def _norm_col(value: object) -> str:
-    text = "" if value is None else str(value)
-    text = text.strip().lower().replace("\u00a0", " ")
-    # Repair common mojibake sequences before normalization.
-    text = (
-        text.replace("Ã©", "e")
-        .replace("Ã¨", "e")
-        .replace("Ãª", "e")
-        .replace("Ã«", "e")
-        .replace("Ã ", "a")
-        .replace("Ã¢", "a")
-        .replace("Ã¹", "u")
-        .replace("Ã»", "u")
-        .replace("Ã´", "o")
-        .replace("Ã®", "i")
-        .replace("Ã¯", "i")
-        .replace("â€™", "'")
-        .replace("â€¢", "")
-    )
-    # Remove accents so matching works with both accented/non-accented headers.
-    text = "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
-    text = re.sub(r"\s+", " ", text)
-    return text
-
-
-def _to_num(value: object) -> float | None:
-    if value is None:
-        return None
-    txt = str(value).strip().replace("\u00a0", "")
-    if not txt:
-        return None
-    txt = txt.replace("%", "").replace(" ", "").replace(",", ".")
-    try:
-        return float(txt)
-    except ValueError:
-        return None
-
-
 def _format_amount(value: object) -> str:
-    num = _to_num(value)
+    num = to_num(value)
     if num is None:
         return str(value)
     return f"{num:,.2f}"
@@ -544,7 +524,7 @@ def _format_amount(value: object) -> str:
 
 def _format_percent(value: object) -> str:
     raw = "" if value is None else str(value).strip()
-    num = _to_num(value)
+    num = to_num(value)
     if num is None:
         return raw
     pct = num
@@ -570,173 +550,54 @@ def _format_table(df: pd.DataFrame, perf_col: str) -> pd.DataFrame:
     return out
 
 
-def _standardize_asfim_columns(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
-    rename_map: dict[str, str] = {}
-    for col in out.columns:
-        n = _norm_col(col)
-        if n == "societe de gestion":
-            rename_map[col] = "Société de Gestion"
-        elif n == "periodicite vl":
-            rename_map[col] = "Périodicité VL"
-        elif n == "code isin":
-            rename_map[col] = "Code ISIN"
-        elif n == "opcvm":
-            rename_map[col] = "OPCVM"
-        elif n == "classification":
-            rename_map[col] = "Classification"
-        elif n == "souscripteurs" or n == "souscripteur":
-            rename_map[col] = "Souscripteurs"
-        elif n == "an":
-            rename_map[col] = "AN"
-        elif n == "vl":
-            rename_map[col] = "VL"
-        elif n in {"ytd", "yield", "yld"}:
-            rename_map[col] = "YTD"
-        elif n == "maturite":
-            rename_map[col] = "Maturité"
-    if rename_map:
-        out = out.rename(columns=rename_map)
-    return out
-
-
 def _col_by_norm(df: pd.DataFrame, target: str) -> str | None:
-    t = _norm_col(target)
+    t = norm_col(target)
     for c in df.columns:
-        if _norm_col(c) == t:
+        if norm_col(c) == t:
             return c
     return None
 
 
-def _detect_headers(raw: pd.DataFrame, frequency: str) -> tuple[int, dict[int, str]] | tuple[None, None]:
-    aliases = {
-        "Code ISIN": {"code isin", "isin"},
-        "OPCVM": {"opcvm"},
-        "Societe de Gestion": {"societe de gestion", "soci??t?? de gestion"},
-        "Periodicite VL": {"periodicite vl", "p??riodicit?? vl", "periodicite", "p??riodicit??"},
-        "Classification": {"classification", "classe"},
-        "Souscripteurs": {"souscripteurs", "souscripteur"},
-        "AN": {"an"},
-        "VL": {"vl"},
-        "YTD": {"ytd", "yield", "yld"},
-        "1 jour": {"1 jour", "1j", "1 journee", "1 journ??e"},
-        "1 semaine": {"1 semaine", "1 sem", "1semaine"},
-    }
-
-    perf_required = "1 jour" if frequency == "quotidien" else "1 semaine"
-
-    for r in range(min(30, len(raw))):
-        vals = raw.iloc[r].tolist()
-        mapped: dict[int, str] = {}
-        for i, v in enumerate(vals):
-            n = _norm_col(v)
-            for canonical, syns in aliases.items():
-                if n in syns:
-                    mapped[i] = canonical
-                    break
-
-        found = set(mapped.values())
-        required = {
-            "Code ISIN",
-            "OPCVM",
-            "Societe de Gestion",
-            "Periodicite VL",
-            "Classification",
-            "Souscripteurs",
-            "AN",
-            "VL",
-            "YTD",
-            perf_required,
-        }
-        if required.issubset(found):
-            return r, mapped
-    return None, None
-
-
-@st.cache_data(show_spinner=False)
-def parse_asfim_file(path: str, frequency: str) -> pd.DataFrame:
-    xls = pd.ExcelFile(path)
-    perf_col = "1 jour" if frequency == "quotidien" else "1 semaine"
-
-    for sheet in xls.sheet_names:
-        raw = xls.parse(sheet_name=sheet, header=None, dtype=str).fillna("")
-        header_row, mapped = _detect_headers(raw, frequency)
-        if header_row is None or mapped is None:
-            continue
-
-        keep = sorted(mapped.items(), key=lambda x: x[0])
-        idxs = [i for i, _ in keep]
-        body = raw.iloc[header_row + 1 :].copy()
-        body = body.iloc[:, idxs]
-        body.columns = [name for _, name in keep]
-        body = body.fillna("")
-        body = body[body["Code ISIN"].astype(str).str.strip() != ""]
-
-        body = _standardize_asfim_columns(body)
-
-        def col_for(norm_name: str) -> str | None:
-            for c in body.columns:
-                if _norm_col(c) == norm_name:
-                    return c
-            return None
-
-        required = {
-            "code isin": col_for("code isin"),
-            "opcvm": col_for("opcvm"),
-            "societe de gestion": col_for("societe de gestion"),
-            "periodicite vl": col_for("periodicite vl"),
-            "classification": col_for("classification"),
-            "souscripteurs": col_for("souscripteurs"),
-            "an": col_for("an"),
-            "vl": col_for("vl"),
-            "ytd": col_for("ytd"),
-            "perf": col_for(_norm_col(perf_col)),
-        }
-        if any(v is None for v in required.values()):
-            continue
-
-        perf_name = "Performance quotidienne" if frequency == "quotidien" else "Performance hebdomadaire"
-        out = pd.DataFrame(
-            {
-                "Code ISIN": body[required["code isin"]],
-                "OPCVM": body[required["opcvm"]],
-                "Soci??t?? de Gestion": body[required["societe de gestion"]],
-                "P??riodicit?? VL": body[required["periodicite vl"]],
-                "Classification": body[required["classification"]],
-                "Souscripteurs": body[required["souscripteurs"]],
-                "AN": body[required["an"]],
-                "VL": body[required["vl"]],
-                "YTD": body[required["ytd"]],
-                perf_name: body[required["perf"]],
-            }
-        )
-        out["performance_num"] = out[perf_name].map(_to_num)
-        return out
-
-    return pd.DataFrame(
-        columns=[
-            "Code ISIN",
-            "OPCVM",
-            "Soci??t?? de Gestion",
-            "P??riodicit?? VL",
-            "Classification",
-            "Souscripteurs",
-            "AN",
-            "VL",
-            "YTD",
-            "Performance quotidienne" if frequency == "quotidien" else "Performance hebdomadaire",
-            "performance_num",
-        ]
+ASFIM_CACHE_MAX_ENTRIES = 96
+ASFIM_CACHE_MAX_BYTES = 512 * 1024 * 1024
+BAM_CACHE_MAX_ENTRIES = 256
+BAM_CACHE_MAX_BYTES = 64 * 1024 * 1024
+CORRELATION_CACHE_MAX_ENTRIES = 32
+CORRELATION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RISK_CACHE_MAX_ENTRIES = 8
+RISK_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Largest memory-cache entries listed on the Export page.
+CACHE_ENTRIES_SHOWN = 50
+RISK_LABELS = {"vol": "Volatilite", "max_drawdown": "Max drawdown", "sharpe": "Sharpe", "hit_ratio": "Hit ratio"}
+# Display column -> risk_metrics column.
+RISK_COLUMNS = {f"{RISK_LABELS[m]} {w}": f"{m}_{w}" for m in RISK_METRICS for w, _ in RISK_WINDOWS}
+RETURN_LABELS = {
+    "return_1M": "Perf 1M",
+    "return_3M": "Perf 3M",
+    "return_6M": "Perf 6M",
+    "return_1Y": "Perf 1Y",
+    "return_YTD": "Perf YTD",
+    "return_origin": "Perf origine",
+}
+OUR_FUNDS_RISK_COLUMNS = ["Volatilite 1M", "Volatilite 3M", "Volatilite 1Y", "Max drawdown 1Y", "Sharpe 1Y", "Hit ratio 1Y"]
+
+
+def parse_asfim_file(
+    path: str,
+    frequency: str,
+    content_hash: str,
+    layout: dict[str, object] | None = None,
+) -> pd.DataFrame:
+    # Path and layout stay out of the key: both follow from the content.
+    cache = memory_cache("asfim_tables", ASFIM_CACHE_MAX_ENTRIES, ASFIM_CACHE_MAX_BYTES)
+    return cache.get_or_compute(
+        (frequency, content_hash or path),
+        lambda: load_asfim_table(path, frequency, content_hash or None, layout),
     )
 
 
-def _latest_file_for_date(frequency: str, date_key: str) -> str | None:
-    records = get_asfim_records(frequency=frequency, date_key=date_key)
-    for rec in records:
-        path = Path(str(rec.get("storage_path", "")))
-        if path.exists():
-            return str(path)
-    return None
+def _parse_asfim_record(rec: dict[str, object], frequency: str) -> pd.DataFrame:
+    return parse_asfim_file(str(rec["storage_path"]), frequency, record_content_hash(rec) or "", rec.get("layout"))
 
 
 def _build_export_excel(df: pd.DataFrame, perf_col: str) -> bytes:
@@ -756,50 +617,54 @@ def _build_export_excel(df: pd.DataFrame, perf_col: str) -> bytes:
 
         if perf_col in df.columns:
             c = df.columns.get_loc(perf_col)
-            for r in range(1, len(df) + 1):
-                raw = str(df.iloc[r - 1, c])
-                num = _to_num(raw)
+            raws = df.iloc[:, c].astype(str)
+            nums = to_num_series(raws).to_numpy()
+            for r, (raw, num) in enumerate(zip(raws, nums), start=1):
                 fmt = None
-                if num is not None:
-                    if num > 0:
-                        fmt = green_fmt
-                    elif num < 0:
-                        fmt = red_fmt
+                if num > 0:
+                    fmt = green_fmt
+                elif num < 0:
+                    fmt = red_fmt
                 ws.write(r, c, raw, fmt)
 
     return buffer.getvalue()
 
 
 def _fund_history(frequency: str, category: str, isin: str) -> pd.DataFrame:
-    dates = list_asfim_dates(frequency)
-    perf_col = "Performance quotidienne" if frequency == "quotidien" else "Performance hebdomadaire"
-    rows: list[dict[str, object]] = []
+    if isin not in ISIN_MAP[frequency].get(category, set()):
+        return pd.DataFrame()
+    hist = load_panel(frequency).history(isin)
+    rows = [
+        {
+            "Date": d,
+            "performance_num": None if pd.isna(perf) else float(perf),
+            "Valeur": "" if pd.isna(perf) else _format_percent(perf),
+        }
+        for d, perf in zip(hist["Date"], hist["performance_num"])
+    ]
+    return pd.DataFrame(rows)
 
-    for d in sorted(dates):
-        path = _latest_file_for_date(frequency, d)
-        if not path:
-            continue
-        df = parse_asfim_file(path, frequency)
-        if df.empty:
-            continue
-        allowed = ISIN_MAP[frequency].get(category, set())
-        df = df[df["Code ISIN"].astype(str).str.strip().isin(allowed)]
-        item = df[df["Code ISIN"].astype(str).str.strip() == isin]
-        if item.empty:
-            continue
-        val = item.iloc[0][perf_col]
-        rows.append({"Date": d, "performance_num": _to_num(val), "Valeur": str(val)})
 
-    return pd.DataFrame(rows)
+def _numeric_column(df: pd.DataFrame, col: str) -> pd.Series:
+    num_col = NUMERIC_COLUMNS.get(col)
+    if num_col is not None and num_col in df.columns:
+        return df[num_col]
+    return to_num_series(df[col])
+
+
+def _isin_column(df: pd.DataFrame) -> pd.Series:
+    if "isin" in df.columns:
+        return df["isin"]
+    return df["Code ISIN"].astype(str).str.strip().str.upper()
 
 
 def _segment_filter_by_classification(df: pd.DataFrame, category: str) -> pd.DataFrame:
     if df.empty or "Classification" not in df.columns:
         return pd.DataFrame(columns=df.columns)
 
-    target = _norm_col(category)
+    target = norm_col(category)
     work = df.copy()
-    work["_cls_norm"] = work["Classification"].astype(str).map(_norm_col)
+    work["_cls_norm"] = work["Classification"].astype(str).map(norm_col)
 
     # Keep all funds where classification text contains the segment keyword.
     if "diversif" in target:
@@ -820,11 +685,11 @@ def _latest_segment_snapshot(frequency: str, category: str) -> tuple[pd.DataFram
     if not dates:
         return pd.DataFrame(), None
 
-    path = _latest_file_for_date(frequency, dates[0])
-    if not path:
+    rec = latest_asfim_record(frequency, dates[0])
+    if not rec:
         return pd.DataFrame(), None
 
-    df = parse_asfim_file(path, frequency)
+    df = _parse_asfim_record(rec, frequency)
     if df.empty:
         return pd.DataFrame(), dates[0]
 
@@ -834,13 +699,13 @@ def _latest_segment_snapshot(frequency: str, category: str) -> tuple[pd.DataFram
         return pd.DataFrame(), dates[0]
 
     df = df.copy()
-    df["Code ISIN"] = df["Code ISIN"].astype(str).str.strip().str.upper()
+    df["Code ISIN"] = df["isin"].astype(str)
 
     # Quotidien: use explicit market ISIN universe (from provided lists) to avoid missing funds.
     if frequency == "quotidien":
         market_set = MARKET_DAILY_ISIN.get(category, set())
         if market_set:
-            seg = df[df["Code ISIN"].isin({x.upper() for x in market_set})].copy()
+            seg = df[df["isin"].isin({x.upper() for x in market_set})].copy()
         else:
             seg = _segment_filter_by_classification(df, category).copy()
     else:
@@ -849,8 +714,7 @@ def _latest_segment_snapshot(frequency: str, category: str) -> tuple[pd.DataFram
     if seg.empty:
         return pd.DataFrame(), dates[0]
 
-    seg["performance_num"] = seg[perf_col].map(_to_num)
-    seg = seg[seg["Code ISIN"] != ""]
+    seg = seg[seg["isin"] != ""]
     return seg, dates[0]
 
 
@@ -860,7 +724,7 @@ def compute_market_stats(df: pd.DataFrame, perf_col: str) -> dict[str, object]:
 
     work = df.copy()
     total_count = int(len(work))
-    work["perf_num"] = work[perf_col].map(_to_num)
+    work["perf_num"] = _numeric_column(work, perf_col)
     valid = work.dropna(subset=["perf_num"]).copy()
     if valid.empty:
         return {
@@ -921,21 +785,21 @@ def compute_fund_vs_market_metrics(selected_row: pd.Series, segment_df: pd.DataF
         return {}
 
     work = segment_df.copy()
-    work["Code ISIN"] = work["Code ISIN"].astype(str).str.strip().str.upper()
-    work["perf_num"] = work[perf_col].map(_to_num)
+    work["isin"] = _isin_column(work)
+    work["perf_num"] = _numeric_column(work, perf_col)
     valid = work.dropna(subset=["perf_num"]).copy()
     if valid.empty:
         return {}
 
     selected_isin = str(selected_row.get("Code ISIN", "")).strip().upper()
-    row = valid[valid["Code ISIN"] == selected_isin]
+    row = valid[valid["isin"] == selected_isin]
     if row.empty:
         return {}
     perf_f = float(row.iloc[0]["perf_num"])
 
     ranked_market = valid.sort_values("perf_num", ascending=False).reset_index(drop=True)
     ranked_market["rank_market"] = ranked_market.index + 1
-    rank_market = int(ranked_market.loc[ranked_market["Code ISIN"] == selected_isin, "rank_market"].iloc[0])
+    rank_market = int(ranked_market.loc[ranked_market["isin"] == selected_isin, "rank_market"].iloc[0])
 
     stats = compute_market_stats(valid, perf_col)
     score = compute_score(perf_f, stats.get("best"), stats.get("worst"))
@@ -957,19 +821,33 @@ def compute_fund_vs_market_metrics(selected_row: pd.Series, segment_df: pd.DataF
     }
 
 
+def _format_risk(column: str, value: object) -> str:
+    if value is None or pd.isna(value):
+        return "-"
+    if RISK_COLUMNS[column].startswith("sharpe_"):
+        return f"{float(value):.2f}"
+    return f"{float(value) * 100:.2f}%"
+
+
+def _format_return(value: object) -> str:
+    if value is None or pd.isna(value):
+        return "N/A"
+    return f"{float(value) * 100:.3f}%"
+
+
 def build_our_funds_table(segment_df: pd.DataFrame, our_funds_filter: set[str], perf_col: str) -> pd.DataFrame:
     if segment_df.empty or perf_col not in segment_df.columns:
         return pd.DataFrame()
 
     market = segment_df.copy()
-    market["Code ISIN"] = market["Code ISIN"].astype(str).str.strip().str.upper()
-    market["perf_num"] = market[perf_col].map(_to_num)
+    market["isin"] = _isin_column(market)
+    market["perf_num"] = _numeric_column(market, perf_col)
     market_valid = market.dropna(subset=["perf_num"]).copy()
     if market_valid.empty:
         return pd.DataFrame()
 
     filt = {x.strip().upper() for x in our_funds_filter}
-    our = market_valid[market_valid["Code ISIN"].isin(filt)].copy()
+    our = market_valid[market_valid["isin"].isin(filt)].copy()
     if our.empty:
         return pd.DataFrame()
 
@@ -980,14 +858,15 @@ def build_our_funds_table(segment_df: pd.DataFrame, our_funds_filter: set[str],
     ranked_our["rank_internal"] = ranked_our.index + 1
 
     stats = compute_market_stats(market_valid, perf_col)
+    risk = _fund_risk_table("quotidien" if perf_col == "Performance quotidienne" else "hebdomadaire")
     rows: list[dict[str, object]] = []
 
     for _, r in ranked_our.iterrows():
-        isin = str(r["Code ISIN"]).strip().upper()
+        isin = str(r["isin"])
         perf_f = float(r["perf_num"])
 
         rank_internal = int(r["rank_internal"])
-        rank_market = int(ranked_market.loc[ranked_market["Code ISIN"] == isin, "rank_market"].iloc[0])
+        rank_market = int(ranked_market.loc[ranked_market["isin"] == isin, "rank_market"].iloc[0])
 
         score = compute_score(perf_f, stats.get("best"), stats.get("worst"))
         quartile, position = compute_quartile(perf_f, stats.get("q1"), stats.get("q2"), stats.get("q3"))
@@ -1006,6 +885,10 @@ def build_our_funds_table(segment_df: pd.DataFrame, our_funds_filter: set[str],
                 "Ecart vs meilleur": (stats.get("best") - perf_f) if stats.get("best") is not None else None,
                 "Ecart vs moyenne": (perf_f - stats.get("mean")) if stats.get("mean") is not None else None,
                 "Ecart vs moins performant": (perf_f - stats.get("worst")) if stats.get("worst") is not None else None,
+                **{
+                    c: risk.at[isin, RISK_COLUMNS[c]] if isin in risk.index else None
+                    for c in OUR_FUNDS_RISK_COLUMNS
+                },
             }
         )
 
@@ -1013,7 +896,7 @@ def build_our_funds_table(segment_df: pd.DataFrame, our_funds_filter: set[str],
 
 
 def _perf_color(v: object) -> str:
-    n = _to_num(v)
+    n = to_num(v)
     if n is None:
         return ""
     if n > 0:
@@ -1031,6 +914,9 @@ def _format_analysis_table(df: pd.DataFrame, perf_cols: list[str]) -> pd.DataFra
     for c in ["Ecart vs meilleur", "Ecart vs moyenne", "Ecart vs moins performant"]:
         if c in out.columns:
             out[c] = out[c].map(_format_percent)
+    for c in RISK_COLUMNS:
+        if c in out.columns:
+            out[c] = out[c].map(lambda v, c=c: _format_risk(c, v))
     return out
 
 
@@ -1050,6 +936,11 @@ def _build_our_funds_excel(df: pd.DataFrame, perf_cols: list[str]) -> bytes:
             ws.write(0, c, name, header_fmt)
             ws.set_column(c, c, max(14, len(str(name)) + 2))
 
+        signed_cols = set(perf_cols) | {"Ecart vs meilleur", "Ecart vs moyenne", "Ecart vs moins performant"}
+        signed_nums = {
+            c: to_num_series(df.iloc[:, c]).to_numpy() for c, col_name in enumerate(df.columns) if col_name in signed_cols
+        }
+
         for r in range(1, len(df) + 1):
             for c, col_name in enumerate(df.columns):
                 raw = df.iloc[r - 1, c]
@@ -1060,10 +951,9 @@ def _build_our_funds_excel(df: pd.DataFrame, perf_cols: list[str]) -> bytes:
                 elif isinstance(raw, (float, int)) and not pd.isna(raw):
                     if math.isinf(float(raw)):
                         safe_raw = ""
-                if col_name in perf_cols or col_name in ["Ecart vs meilleur", "Ecart vs moyenne", "Ecart vs moins performant"]:
-                    n = _to_num(raw)
-                    if n is not None:
-                        fmt = green_fmt if n > 0 else red_fmt if n < 0 else None
+                if c in signed_nums:
+                    n = signed_nums[c][r - 1]
+                    fmt = green_fmt if n > 0 else red_fmt if n < 0 else None
                 if col_name == "Score":
                     fmt = score_fmt
                 ws.write(r, c, safe_raw, fmt)
@@ -1107,12 +997,13 @@ def _render_category_page(category: str) -> None:
         q_dates = list_asfim_dates("quotidien")
         if q_dates:
             q_pick = st.selectbox("Date ASFIM Quotidien", q_dates, key=f"pick_daily_{category}")
-            q_path = _latest_file_for_date("quotidien", q_pick)
-            if q_path and Path(q_path).exists():
+            q_rec = latest_asfim_record("quotidien", q_pick)
+            if q_rec:
+                q_path = Path(str(q_rec["storage_path"]))
                 st.download_button(
                     "Telecharger fichier quotidien",
-                    data=Path(q_path).read_bytes(),
-                    file_name=Path(q_path).name,
+                    data=q_path.read_bytes(),
+                    file_name=str(q_rec.get("filename") or q_path.name),
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     key=f"dl_daily_{category}",
                 )
@@ -1123,12 +1014,13 @@ def _render_category_page(category: str) -> None:
         h_dates = list_asfim_dates("hebdomadaire")
         if h_dates:
             h_pick = st.selectbox("Date ASFIM Hebdomadaire", h_dates, key=f"pick_weekly_{category}")
-            h_path = _latest_file_for_date("hebdomadaire", h_pick)
-            if h_path and Path(h_path).exists():
+            h_rec = latest_asfim_record("hebdomadaire", h_pick)
+            if h_rec:
+                h_path = Path(str(h_rec["storage_path"]))
                 st.download_button(
                     "Telecharger fichier hebdomadaire",
-                    data=Path(h_path).read_bytes(),
-                    file_name=Path(h_path).name,
+                    data=h_path.read_bytes(),
+                    file_name=str(h_rec.get("filename") or h_path.name),
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     key=f"dl_weekly_{category}",
                 )
@@ -1237,7 +1129,7 @@ def _render_category_page(category: str) -> None:
     options = [f"{r['OPCVM']} ({r['Code ISIN']})" for _, r in active_df.iterrows()]
     selected = st.selectbox("Selectionner un fonds", options=options, key=f"fund_{category}_{freq_ui}")
     isin = selected.split("(")[-1].replace(")", "").strip().upper()
-    row = active_df[active_df["Code ISIN"].astype(str).str.strip().str.upper() == isin]
+    row = active_df[active_df["isin"] == isin]
     if row.empty:
         st.warning("Fonds introuvable.")
         return
@@ -1251,6 +1143,12 @@ def _render_category_page(category: str) -> None:
     id2.metric("ISIN", str(selected_row.get("Code ISIN", "N/A")))
     id3.metric("Classification", str(selected_row.get("Classification", "N/A")))
 
+    fund_ret = fund_returns(load_panel("quotidien" if freq_ui == "Quotidien" else "hebdomadaire"), {isin})
+    if not fund_ret.empty:
+        st.markdown("#### Performances VL par horizon")
+        for col, (key, label) in zip(st.columns(len(RETURN_LABELS)), RETURN_LABELS.items()):
+            col.metric(label, _format_return(fund_ret.iloc[0][key]))
+
     p1, p2 = st.columns(2)
     with p1:
         st.markdown("#### Positionnement Quotidien")
@@ -1283,10 +1181,9 @@ def _render_category_page(category: str) -> None:
         st.markdown("#### Comparaison vs classification (Quotidien)")
         if d_metrics and not daily_df.empty and "Classification" in daily_df.columns:
             sub = daily_df[daily_df["Classification"].astype(str).str.strip().str.lower() == class_value].copy()
-            sub["n"] = sub["Performance quotidienne"].map(_to_num)
-            sub = sub.dropna(subset=["n"])
+            sub = sub.dropna(subset=["performance_num"])
             if not sub.empty:
-                mean_class = float(sub["n"].mean())
+                mean_class = float(sub["performance_num"].mean())
                 msg = "Surperforme sa classification" if d_metrics["perf"] > mean_class else "Sous-performe sa classification"
                 st.success(f"{msg} (moyenne classe: {_format_percent(mean_class)})")
 
@@ -1295,10 +1192,9 @@ def _render_category_page(category: str) -> None:
             st.markdown("#### Comparaison vs classification (Hebdomadaire)")
             if w_metrics and not weekly_df.empty and "Classification" in weekly_df.columns:
                 sub = weekly_df[weekly_df["Classification"].astype(str).str.strip().str.lower() == class_value].copy()
-                sub["n"] = sub["Performance hebdomadaire"].map(_to_num)
-                sub = sub.dropna(subset=["n"])
+                sub = sub.dropna(subset=["performance_num"])
                 if not sub.empty:
-                    mean_class = float(sub["n"].mean())
+                    mean_class = float(sub["performance_num"].mean())
                     msg = "Surperforme sa classification" if w_metrics["perf"] > mean_class else "Sous-performe sa classification"
                     st.success(f"{msg} (moyenne classe: {_format_percent(mean_class)})")
 
@@ -1319,8 +1215,7 @@ def _render_category_page(category: str) -> None:
     if lb_df.empty:
         st.info("Classement indisponible.")
     else:
-        lb_df["perf_num"] = lb_df[lb_perf].map(_to_num)
-        lb_show_raw = lb_df.sort_values("perf_num", ascending=False, na_position="last")[["Code ISIN", "OPCVM", "Classification", lb_perf]].copy()
+        lb_show_raw = lb_df.sort_values("performance_num", ascending=False, na_position="last")[["Code ISIN", "OPCVM", "Classification", lb_perf]].copy()
         lb_show = lb_show_raw.copy()
         lb_show[lb_perf] = lb_show[lb_perf].map(_format_percent)
         st.dataframe(lb_show.style.applymap(_perf_color, subset=[lb_perf]), use_container_width=True)
@@ -1372,79 +1267,18 @@ def _mati_pivot_days(date_c1: date) -> int:
     return mati(date_c1, 1)
 
 
-def _norm_bam_col(v: str) -> str:
-    t = str(v).strip().lower().replace("\u00a0", " ")
-    t = t.replace("’", "'")
-    # Remove accents robustly (é -> e, etc.) for BAM header matching.
-    t = "".join(ch for ch in unicodedata.normalize("NFKD", t) if not unicodedata.combining(ch))
-    t = re.sub(r"\s+", " ", t)
-    return t
-
-
-def _parse_dt_any(v: object) -> date | None:
-    if v is None:
-        return None
-    s = str(v).strip()
-    if not s:
-        return None
-    for dayfirst in (True, False):
-        d = pd.to_datetime(s, dayfirst=dayfirst, errors="coerce")
-        if pd.notna(d):
-            return d.date()
-    return None
-
-
-@st.cache_data(show_spinner=False)
-def _parse_bam_curve_file(path: str) -> tuple[pd.DataFrame, str | None]:
-    xls = pd.ExcelFile(path)
-    for sheet in xls.sheet_names:
-        df = xls.parse(sheet_name=sheet, dtype=str).fillna("")
-        if df.empty:
-            continue
-        cols = list(df.columns)
-        m_col = None
-        t_col = None
-        v_col = None
-        for c in cols:
-            n = _norm_bam_col(str(c))
-            if "date d'echeance" in n or "date d'cheance" in n or "echeance" in n:
-                m_col = c
-            if "taux moyen pondere" in n or n == "taux":
-                t_col = c
-            if "date de la valeur" in n or "date de valeur" in n:
-                v_col = c
-        if not (m_col and t_col):
-            continue
-        work = df[[m_col, t_col] + ([v_col] if v_col else [])].copy()
-        work.columns = ["DateEcheance", "Taux"] + (["DateValeur"] if v_col else [])
-        work = work[work["DateEcheance"].astype(str).str.strip() != ""]
-        if work.empty:
-            continue
-        if "DateValeur" in work.columns:
-            vals = work["DateValeur"].map(_parse_dt_any).dropna()
-            if vals.empty:
-                continue
-            mode_vals = vals.mode()
-            if mode_vals.empty:
-                continue
-            date_valeur = mode_vals.iloc[0]
-        else:
-            continue
-        work["DateEcheance_dt"] = work["DateEcheance"].map(_parse_dt_any)
-        work["maturity_days"] = work["DateEcheance_dt"].map(
-            lambda d: (d - date_valeur).days if d is not None else None
-        )
-        work["rate_num"] = work["Taux"].map(_to_num)
-        work = work.dropna(subset=["maturity_days", "rate_num"])
-        work = work[work["maturity_days"] > 0]
-        if work.empty:
-            continue
-        # Convert percent-like values to decimal rates for interpolation.
-        work["rate_dec"] = work["rate_num"].map(lambda x: x / 100.0 if x > 1 else x)
-        return work[["maturity_days", "rate_dec"]].sort_values("maturity_days"), date_valeur.strftime("%Y-%m-%d")
-    return pd.DataFrame(columns=["maturity_days", "rate_dec"]), None
+def _parse_bam_curve_file(path: str, content_hash: str) -> tuple[pd.DataFrame, str | None]:
+    if not content_hash:
+        return parse_bam_curve(path)
+    cache = memory_cache("bam_curves", BAM_CACHE_MAX_ENTRIES, BAM_CACHE_MAX_BYTES)
+    return cache.get_or_compute(
+        content_hash,
+        lambda: cached("bam_curve", BAM_CURVE_SCHEMA_VERSION, (content_hash,), lambda: parse_bam_curve(path)),
+    )
 
 
+# Bump when TARGET_MATS or the interpolation changes so cached curve points are recomputed.
+CURVE_POINTS_VERSION = 1
 TARGET_MATS = [
     ("13 s", 13 * 7),
     ("26 s", 26 * 7),
@@ -1458,31 +1292,41 @@ TARGET_MATS = [
 ]
 
 
-def _latest_bam_file_for_date(date_key: str) -> str | None:
-    records = get_bam_records(date_key=date_key)
-    for rec in records:
-        p = Path(str(rec.get("storage_path", "")))
-        if p.exists():
-            return str(p)
-    return None
-
-
-@st.cache_data(show_spinner=False)
 def _build_bam_curve_points(date_key: str) -> dict[str, float] | None:
-    path = _latest_bam_file_for_date(date_key)
-    if not path:
+    rec = latest_bam_record(date_key)
+    if not rec:
         return None
-    curve, dstr = _parse_bam_curve_file(path)
+    return _bam_curve_points_from_file(str(rec["storage_path"]), record_content_hash(rec) or "")
+
+
+def _bam_curve_points_from_file(path: str, content_hash: str) -> dict[str, float] | None:
+    if not content_hash:
+        return _compute_bam_curve_points(path, content_hash)
+    cache = memory_cache("bam_curve_points", BAM_CACHE_MAX_ENTRIES, BAM_CACHE_MAX_BYTES)
+    return cache.get_or_compute(
+        content_hash,
+        lambda: cached(
+            "bam_curve_points",
+            CURVE_POINTS_VERSION,
+            (content_hash, BAM_CURVE_SCHEMA_VERSION),
+            lambda: _compute_bam_curve_points(path, content_hash),
+        ),
+    )
+
+
+def _compute_bam_curve_points(path: str, content_hash: str) -> dict[str, float] | None:
+    curve, dstr = _parse_bam_curve_file(path, content_hash)
     if curve.empty or not dstr:
         return None
     mt = [int(v) for v in curve["maturity_days"].tolist()]
     tx = [float(v) for v in curve["rate_dec"].tolist()]
     date_c1 = datetime.strptime(dstr, "%Y-%m-%d").date()
     pivot = _mati_pivot_days(date_c1)
-    out: dict[str, float] = {}
-    for label, days in TARGET_MATS:
-        out[label] = calcul_taux(days, mt, tx, date_c1, pivot)
-    return out
+    yield_curve = YieldCurve.from_points(mt, tx, date_c1, pivot)
+    if yield_curve is None:
+        return {label: calcul_taux(days, mt, tx, date_c1, pivot) for label, days in TARGET_MATS}
+    rates = yield_curve.evaluate(np.array([days for _, days in TARGET_MATS]))
+    return {label: float(rate) for (label, _), rate in zip(TARGET_MATS, rates)}
 
 
 def _build_bam_compare_export(selected_j: str, selected_j1: str) -> bytes | None:
@@ -1594,54 +1438,105 @@ def _curve_reco_comment_from_history(
     return reco, com
 
 
-def _asfim_daily_fund_timeseries() -> tuple[dict[str, list[tuple[str, float]]], dict[str, str]]:
-    dates = list_asfim_dates("quotidien")
-    data: dict[str, list[tuple[str, float]]] = {}
-    names: dict[str, str] = {}
-    if not dates:
-        return data, names
+CORRELATION_WINDOWS = {"Tout l'historique": None, "20 dernières dates": 20, "60 dernières dates": 60}
+
+
+def _curve_metric(date_key: str) -> float | None:
+    """Mean of the interpolated TARGET_MATS rates of one BAM date."""
+    curve = _build_bam_curve_points(date_key)
+    if not curve:
+        return None
+    vals = [curve.get(label) for label, _ in TARGET_MATS if curve.get(label) is not None]
+    return sum(vals) / len(vals) if vals else None
+
+
+def _curve_metric_by_date() -> dict[str, float]:
+    out: dict[str, float] = {}
+    for d in list_bam_dates():
+        value = _curve_metric(d)
+        if value is not None:
+            out[d] = value
+    return out
+
+
+class _CurveMetricSeries(Mapping):
+    """`_curve_metric` as a mapping evaluated on lookup, so the running correlation sums only touch new dates."""
+
+    def __getitem__(self, date_key: str) -> float:
+        value = _curve_metric(date_key)
+        if value is None:
+            raise KeyError(date_key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(_curve_metric_by_date())
+
+    def __len__(self) -> int:
+        return len(_curve_metric_by_date())
+
+
+def _short_rate_by_date() -> dict[str, float]:
+    """BAM 13-week rate per date, the risk-free leg of the Sharpe ratios."""
+    out: dict[str, float] = {}
+    for d in list_bam_dates():
+        curve = _build_bam_curve_points(d)
+        if curve and curve.get("13 s") is not None:
+            out[d] = float(curve["13 s"])
+    return out
+
+
+def _fund_risk_table(frequency: str) -> pd.DataFrame:
+    panel = load_panel(frequency)
+    # BAM uploads move the catalog version, so short rates are only read on a miss.
+    key = (frequency, panel.revision, history_version())
+    cache = memory_cache("fund_risk", RISK_CACHE_MAX_ENTRIES, RISK_CACHE_MAX_BYTES)
+    return cache.get_or_compute(
+        key, lambda: risk_metrics(panel.matrix("vl_num"), _short_rate_by_date(), PERIODS_PER_YEAR[frequency])
+    )
+
+
+def _fund_curve_correlations(window: int | None = None) -> pd.DataFrame:
+    panel = load_panel("quotidien")
     allowed_all = set().union(*ISIN_MAP["quotidien"].values())
-    for d in dates:
-        path = _latest_file_for_date("quotidien", d)
-        if not path:
-            continue
-        df = parse_asfim_file(path, "quotidien")
-        if df.empty or "Performance quotidienne" not in df.columns:
-            continue
-        df = df[df["Code ISIN"].astype(str).str.strip().isin(allowed_all)]
-        for _, r in df.iterrows():
-            isin = str(r["Code ISIN"]).strip()
-            perf = _to_num(r["Performance quotidienne"])
-            if perf is None:
-                continue
-            names[isin] = str(r["OPCVM"])
-            data.setdefault(isin, []).append((d, perf))
-    return data, names
+    # The catalog version moves with every BAM upload, so the key stays O(1) in the number of dates.
+    key = (panel.revision, history_version(), window, CORRELATION_MIN_PERIODS)
+
+    def compute() -> pd.DataFrame:
+        if window is None:
+            # Running sums kept across ingests: only fund dates appended and BAM dates uploaded
+            # since the last call are read.
+            corr = series_correlations(
+                f"quotidien.curve_mean.v{CURVE_POINTS_VERSION}",
+                panel,
+                _CurveMetricSeries(),
+                series_changes=bam_dates_since,
+            )["corr"]
+            corr = corr[corr.index.isin(allowed_all)]
+        else:
+            perf = panel.matrix("performance_num", allowed_all)
+            curve = pd.Series(_curve_metric_by_date(), dtype="float64")
+            # Window ending at the latest fund date.
+            corr = (
+                rolling_correlate_rows(perf, curve, window).iloc[:, -1]
+                if perf.shape[1]
+                else pd.Series(np.nan, index=perf.index)
+            )
+        labels = [f"{panel.name(isin)} ({isin})" for isin in corr.index]
+        return pd.DataFrame({"label": labels, "corr": corr.to_numpy()}, index=corr.index)
 
+    cache = memory_cache("fund_curve_correlations", CORRELATION_CACHE_MAX_ENTRIES, CORRELATION_CACHE_MAX_BYTES)
+    return cache.get_or_compute(key, compute)
 
-def _correlation_insights(curve_metric_by_date: dict[str, float]) -> tuple[str | None, float | None, str | None, float | None]:
-    if not curve_metric_by_date:
-        return None, None, None, None
-    fund_ts, names = _asfim_daily_fund_timeseries()
-    if not fund_ts:
-        return None, None, None, None
 
-    s_curve = pd.Series(curve_metric_by_date, name="curve")
-    corr_scores: list[tuple[str, float]] = []
-    for isin, points in fund_ts.items():
-        s_fund = pd.Series({d: v for d, v in points}, name="fund")
-        merged = pd.concat([s_fund, s_curve], axis=1, join="inner").dropna()
-        if len(merged) < 3:
-            continue
-        corr = merged["fund"].corr(merged["curve"])
-        if pd.notna(corr):
-            corr_scores.append((f"{names.get(isin, isin)} ({isin})", float(corr)))
-    if not corr_scores:
+def _correlation_insights(window: int | None = None) -> tuple[str | None, float | None, str | None, float | None]:
+    scores = _fund_curve_correlations(window).dropna(subset=["corr"])
+    if scores.empty:
         return None, None, None, None
 
-    most = max(corr_scores, key=lambda x: abs(x[1]))
-    least = min(corr_scores, key=lambda x: abs(x[1]))
-    return most[0], most[1] * 100.0, least[0], least[1] * 100.0
+    strength = scores["corr"].abs().to_numpy()
+    most = scores.iloc[int(np.argmax(strength))]
+    least = scores.iloc[int(np.argmin(strength))]
+    return most["label"], float(most["corr"]) * 100.0, least["label"], float(least["corr"]) * 100.0
 
 
 def _render_curve_page() -> None:
@@ -1682,7 +1577,7 @@ def _render_curve_page() -> None:
         display[c] = display[c].map(fmt_pct)
 
     def style_var(v: object) -> str:
-        n = _to_num(v)
+        n = to_num(v)
         if n is None:
             return ""
         if n < 0:
@@ -1719,7 +1614,7 @@ def _render_curve_page() -> None:
                     raw = str(df_display.iloc[r - 1, c])
                     fmt = default_cell
                     if first_col_val == "VAR":
-                        n = _to_num(raw)
+                        n = to_num(raw)
                         if n is not None:
                             fmt = green_var if n > 0 else red_var
                     ws.write(r, c, raw, fmt)
@@ -1742,16 +1637,9 @@ def _render_curve_page() -> None:
     st.markdown(f"**Recommandations:** {reco}")
     st.markdown(f"**Commentaires:** {com}")
 
-    curve_metric_by_date: dict[str, float] = {}
-    for d in dates:
-        curve = _build_bam_curve_points(d)
-        if not curve:
-            continue
-        vals = [curve.get(k) for k in cols if curve.get(k) is not None]
-        if vals:
-            curve_metric_by_date[d] = sum(vals) / len(vals)
-    most_name, most_corr, least_name, least_corr = _correlation_insights(curve_metric_by_date)
     st.markdown("### Corrélation à la courbe BAM")
+    window_label = st.selectbox("Fenêtre de corrélation", list(CORRELATION_WINDOWS), index=0)
+    most_name, most_corr, least_name, least_corr = _correlation_insights(CORRELATION_WINDOWS[window_label])
     if most_name is None:
         st.info("Données insuffisantes pour calculer les corrélations.")
     else:
@@ -1776,20 +1664,20 @@ def _latest_universe_df() -> pd.DataFrame:
         dates = list_asfim_dates(frequency)
         if not dates:
             continue
-        path = _latest_file_for_date(frequency, dates[0])
-        if not path:
+        rec = latest_asfim_record(frequency, dates[0])
+        if not rec:
             continue
-        df = parse_asfim_file(path, frequency)
+        df = _parse_asfim_record(rec, frequency)
         if df.empty:
             continue
         perf_col = "Performance quotidienne" if frequency == "quotidien" else "Performance hebdomadaire"
         allowed = set().union(*ISIN_MAP[frequency].values())
-        df = df[df["Code ISIN"].astype(str).str.strip().isin(allowed)].copy()
+        df = df[df["isin"].isin(allowed)].copy()
         if df.empty:
             continue
         df["Frequency"] = frequency
         df["Date"] = dates[0]
-        df["Category"] = df["Code ISIN"].astype(str).str.strip().map(lambda x: _category_from_isin(frequency, x))
+        df["Category"] = df["isin"].astype(str).map(lambda x: _category_from_isin(frequency, x))
         df["PerfLabel"] = perf_col
         frames.append(df)
     if not frames:
@@ -1867,14 +1755,37 @@ elif page == "Analyse":
             show_cols = [c for c in show_cols if c in details.columns]
             details_display = _format_table(details[show_cols], "Performance")
             st.dataframe(details_display, use_container_width=True)
+
+            st.markdown("### Risque (historique VL)")
+            risk_frames = [
+                work[work["Frequency"] == frequency]
+                .join(_fund_risk_table(frequency), on="isin")
+                .rename(columns={key: c for c, key in RISK_COLUMNS.items()})
+                for frequency in ["quotidien", "hebdomadaire"]
+            ]
+            risk_view = pd.concat(risk_frames, ignore_index=True)[["Code ISIN", "OPCVM", "Category", "Frequency", *RISK_COLUMNS]]
+            st.dataframe(_format_analysis_table(risk_view, []), use_container_width=True)
 elif page == "Export":
     st.subheader("Export")
     c_refresh, _ = st.columns([1, 5])
     with c_refresh:
         if st.button("Mise à jour", use_container_width=True):
-            st.cache_data.clear()
+            clear_memory_caches()
             st.rerun()
 
+    with st.expander("Cache m\u00e9moire", expanded=False):
+        cache_stats = memory_cache_stats()
+        if not cache_stats:
+            st.info("Aucun cache actif.")
+        else:
+            st.dataframe(pd.DataFrame(cache_stats), use_container_width=True, hide_index=True)
+            st.caption("Entr\u00e9es les plus volumineuses")
+            st.dataframe(
+                pd.DataFrame(memory_cache_entries(CACHE_ENTRIES_SHOWN), columns=["cache", "key", "bytes"]),
+                use_container_width=True,
+                hide_index=True,
+            )
+
     st.markdown("### Section ASFIM - Upload Historique")
     frequency_ui = st.radio(
         "Type de fichier",
@@ -1902,12 +1813,18 @@ elif page == "Export":
             result = add_asfim_files(uploaded_files, frequency=frequency, batch_date_key=batch_date_key or None)
             saved_count = len(result["saved"])
             error_count = len(result["errors"])
+            if saved_count:
+                # Append the new dates to the fund panel and its horizon returns now rather than on the next query.
+                fund_returns(load_panel(frequency))
+                if frequency == "quotidien":
+                    _fund_curve_correlations()
 
             if saved_count:
                 st.success(f"{saved_count} fichier(s) ASFIM enregistré(s).")
                 for item in result["saved"]:
+                    dup = " | d\u00e9j\u00e0 archiv\u00e9 (m\u00eame contenu)" if item.get("deduplicated") else ""
                     st.caption(
-                        f"- {item['filename']} | date={item['date_key']} | type={item['frequency']} | source_date={item['date_source']}"
+                        f"- {item['filename']} | date={item['date_key']} | type={item['frequency']} | source_date={item['date_source']}{dup}"
                     )
 
             if error_count:
@@ -1962,6 +1879,9 @@ elif page == "Export":
             result = add_bam_files(bam_uploaded_files, batch_date_key=bam_batch_date_key or None)
             saved_count = len(result["saved"])
             error_count = len(result["errors"])
+            if saved_count:
+                # Fold the new curve dates into the fund/curve correlation sums.
+                _fund_curve_correlations()
 
             if saved_count:
                 st.success(f"{saved_count} fichier(s) BAM enregistré(s).")
@@ -0,0 +1,39 @@
+﻿"""Time init_storage() as run on every Streamlit rerun and check it leaves the catalog version alone.
+
+Usage: python benchmarks/bench_init_storage.py path/to/data/parent [repeat]
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        raise SystemExit(__doc__)
+    # Paths in storage are relative to the working directory, as in the app.
+    os.chdir(sys.argv[1])
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    from storage import _history_index, history_version, init_storage
+
+    init_storage()
+    version = history_version()
+    index = _history_index()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        init_storage()
+    elapsed = time.perf_counter() - start
+
+    unchanged = history_version() == version and _history_index() is index
+    print(f"init_storage x{repeat}: {elapsed / repeat * 1e3:.3f} ms/appel | version {version} inchangée={unchanged}")
+    if not unchanged:
+        raise SystemExit("init_storage sans changement a modifié la version du catalogue")
+
+
+if __name__ == "__main__":
+    main()
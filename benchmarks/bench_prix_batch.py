@@ -0,0 +1,105 @@
+﻿"""Compare standalone prix_amortissable calls, bond by bond, with prix_amortissable_batch on one BAM curve.
+
+Usage: python benchmarks/bench_prix_batch.py path/to/bam.xlsx [bonds] [repeat]
+"""
+from __future__ import annotations
+
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from parsers import parse_bam_curve  # noqa: E402
+from vba_finance import (  # noqa: E402
+    DateSerial,
+    _cached_curve,
+    _cached_ladder,
+    prix_amortissable,
+    prix_amortissable_batch,
+)
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        # Both sides start from cold curve and ladder caches.
+        _cached_curve.cache_clear()
+        _cached_ladder.cache_clear()
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _inventory(date_valeur, count: int) -> list[dict[str, object]]:
+    rng = random.Random(0)
+    bonds = []
+    for _ in range(count):
+        nbramort = rng.randint(2, 20)
+        emission = DateSerial(date_valeur.year - rng.randint(0, nbramort - 1), rng.randint(1, 12), rng.randint(1, 28))
+        bonds.append(
+            {
+                "date_emission": emission,
+                "date_echeance": DateSerial(emission.year + nbramort, emission.month, emission.day),
+                "date_jouissance": emission,
+                "nominal": 100_000,
+                "tf": round(rng.uniform(0.02, 0.06), 4),
+                "spread": round(rng.uniform(0.0, 0.01), 4),
+                "nbramort": nbramort,
+            }
+        )
+    return bonds
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        raise SystemExit(__doc__)
+    path = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    curve, dstr = parse_bam_curve(path)
+    if curve.empty or not dstr:
+        raise SystemExit(f"{path}: courbe BAM illisible")
+    mt = [int(v) for v in curve["maturity_days"].tolist()]
+    tx = [float(v) for v in curve["rate_dec"].tolist()]
+    date_valeur = datetime.strptime(dstr, "%Y-%m-%d").date()
+    bonds = _inventory(date_valeur, count)
+    print(f"{path}: {len(mt)} points, {count} obligations au {dstr}")
+
+    def scalar():
+        results = []
+        for b in bonds:
+            # Cold memos for every bond: the baseline is one standalone pricing per bond.
+            _cached_curve.cache_clear()
+            _cached_ladder.cache_clear()
+            results.append(
+                prix_amortissable(
+                    date_valeur,
+                    b["date_emission"],
+                    b["date_echeance"],
+                    b["date_jouissance"],
+                    b["nominal"],
+                    b["tf"],
+                    b["spread"],
+                    b["nbramort"],
+                    mt,
+                    tx,
+                )
+            )
+        return results
+
+    def batch():
+        return prix_amortissable_batch(bonds, date_valeur, mt, tx)
+
+    same = all(a == b for a, b in zip(scalar(), batch()))
+    t_scalar = _best_of(scalar, repeat)
+    t_batch = _best_of(batch, repeat)
+    print(f"scalaire {t_scalar * 1e3:8.2f} ms | batch {t_batch * 1e3:8.2f} ms | x{t_scalar / t_batch:5.1f} | identique={same}")
+
+
+if __name__ == "__main__":
+    main()
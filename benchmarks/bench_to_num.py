@@ -0,0 +1,49 @@
+﻿"""Compare to_num mapped cell by cell with to_num_series on a full SFIM workbook.
+
+Usage: python benchmarks/bench_to_num.py path/to/sfim.xlsx [quotidien|hebdomadaire] [repeat]
+"""
+from __future__ import annotations
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from parsers import parse_asfim_workbook, perf_column_name, to_num, to_num_series  # noqa: E402
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        raise SystemExit(__doc__)
+    path = sys.argv[1]
+    frequency = sys.argv[2] if len(sys.argv) > 2 else "quotidien"
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    table = parse_asfim_workbook(path, frequency)
+    columns = ["AN", "VL", "YTD", perf_column_name(frequency)]
+    print(f"{path}: {len(table)} lignes, colonnes {columns}")
+
+    for col in columns:
+        values = table[col]
+        mapped = values.map(to_num).astype("float64").to_numpy()
+        vectorised = to_num_series(values).to_numpy()
+        same = np.array_equal(mapped, vectorised, equal_nan=True)
+        t_map = _best_of(lambda: values.map(to_num), repeat)
+        t_vec = _best_of(lambda: to_num_series(values), repeat)
+        print(f"{col:>26}: map {t_map * 1e3:8.2f} ms | series {t_vec * 1e3:8.2f} ms | x{t_map / t_vec:5.1f} | identique={same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+﻿from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import closing, contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator
+
+import numpy as np
+import pandas as pd
+
+from storage import (
+    BASE_DATA_DIR,
+    date_key_order,
+    history_version,
+    latest_asfim_record,
+    list_asfim_dates,
+    load_asfim_table,
+    record_content_hash,
+)
+
+PANEL_DIR = BASE_DATA_DIR / "panels"
+PANEL_LAYERS = ("performance_num", "vl_num", "an_num", "ytd_num")
+PANEL_MIN_CAPACITY = 256
+PANEL_MIN_ORPHANS = 64
+
+_panel_lock = threading.Lock()
+_panel_memo: dict[str, tuple[tuple, "FundPanel"]] = {}
+
+
+@dataclass
+class FundPanel:
+    """Fund x date values of one ASFIM frequency, backed by read-only memmaps.
+
+    Each layer is a (rows, capacity) file: one row per archived date in arrival order and one
+    column slot per ISIN. `index` maps dates to rows and `sources` to the workbook they came
+    from; `matrix` and `history` present the data with ISINs as rows and dates in
+    chronological order.
+    `revision` changes whenever the content does, so derived results can be cached on it.
+    Rows only grow within a `generation`, so `row_count` is a watermark for what was added.
+    """
+
+    frequency: str
+    revision: int = 0
+    generation: int = 0
+    row_count: int = 0
+    isins: list[str] = field(default_factory=list)
+    names: list[str] = field(default_factory=list)
+    index: dict[str, int] = field(default_factory=dict)
+    sources: dict[str, str] = field(default_factory=dict)
+    present: np.ndarray = field(default_factory=lambda: np.zeros((0, 0), dtype=np.uint8))
+    layers: dict[str, np.ndarray] = field(
+        default_factory=lambda: {layer: np.zeros((0, 0), dtype="float64") for layer in PANEL_LAYERS}
+    )
+
+    def __post_init__(self) -> None:
+        self._isin_pos = {isin: i for i, isin in enumerate(self.isins)}
+
+    @property
+    def dates(self) -> list[str]:
+        return sorted(self.index, key=date_key_order)
+
+    def _rows(self) -> tuple[list[str], np.ndarray]:
+        dates = self.dates
+        return dates, np.fromiter((self.index[d] for d in dates), dtype=np.intp, count=len(dates))
+
+    def dates_since(self, row: int) -> list[str]:
+        """Dates appended (new or re-uploaded) at or after `row` in this generation."""
+        out = []
+        for date_key, date_row in reversed(self.index.items()):
+            if date_row < row:
+                break
+            out.append(date_key)
+        return out
+
+    def name(self, isin: str) -> str:
+        pos = self._isin_pos.get(isin)
+        return self.names[pos] if pos is not None else isin
+
+    def matrix(self, layer: str = "performance_num", isins: set[str] | None = None) -> pd.DataFrame:
+        dates, rows = self._rows()
+        cols = np.arange(len(self.isins))
+        if isins is not None:
+            cols = np.fromiter((i for i, isin in enumerate(self.isins) if isin in isins), dtype=np.intp)
+        values = self.layers[layer][np.ix_(rows, cols)] if len(rows) else np.empty((0, len(cols)))
+        return pd.DataFrame(values.T, index=pd.Index([self.isins[i] for i in cols], name="isin"), columns=dates)
+
+    def history(self, isin: str, layer: str = "performance_num") -> pd.DataFrame:
+        pos = self._isin_pos.get(isin)
+        if pos is None:
+            return pd.DataFrame(columns=["Date", layer])
+        dates, rows = self._rows()
+        mask = self.present[rows, pos].astype(bool) if len(rows) else np.zeros(0, dtype=bool)
+        return pd.DataFrame(
+            {"Date": [d for d, keep in zip(dates, mask) if keep], layer: self.layers[layer][rows[mask], pos]}
+        )
+
+
+def _panel_dir(frequency: str) -> Path:
+    return PANEL_DIR / frequency
+
+
+def _layer_path(frequency: str, generation: int, layer: str) -> Path:
+    return _panel_dir(frequency) / f"{layer}.g{generation}.bin"
+
+
+def _read_index(frequency: str) -> dict[str, Any]:
+    try:
+        with (_panel_dir(frequency) / "index.json").open("r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {
+            "revision": 0,
+            "generation": 0,
+            "capacity": 0,
+            "row_count": 0,
+            "isins": [],
+            "names": [],
+            "dates": {},
+            "sources": {},
+            "failed": {},
+        }
+
+
+def _write_index(frequency: str, meta: dict[str, Any]) -> None:
+    path = _panel_dir(frequency) / "index.json"
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as fh:
+        json.dump(meta, fh, ensure_ascii=False)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+
+
+def _map(path: Path, dtype: str, rows: int, capacity: int, mode: str = "r") -> np.ndarray:
+    if rows == 0 or capacity == 0:
+        return np.zeros((rows, capacity), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, shape=(rows, capacity))
+
+
+def _layer_dtype(layer: str) -> str:
+    return "uint8" if layer == "present" else "float64"
+
+
+def _open_panel(frequency: str) -> FundPanel:
+    meta = _read_index(frequency)
+    generation, rows, capacity = meta["generation"], meta["row_count"], meta["capacity"]
+    arrays = {
+        layer: _map(_layer_path(frequency, generation, layer), _layer_dtype(layer), rows, capacity)
+        for layer in ("present", *PANEL_LAYERS)
+    }
+    present = arrays.pop("present")
+    return FundPanel(
+        frequency,
+        revision=meta.get("revision", 0),
+        generation=generation,
+        row_count=rows,
+        isins=meta["isins"],
+        names=meta["names"],
+        # In row order, so the latest appends are at the end (see dates_since).
+        index=dict(sorted(meta["dates"].items(), key=lambda item: item[1])),
+        sources=dict(meta["sources"]),
+        present=present,
+        layers=arrays,
+    )
+
+
+@contextmanager
+def _writer_lock(frequency: str) -> Iterator[None]:
+    # SQLite's file lock serialises writers across processes on every platform.
+    _panel_dir(frequency).mkdir(parents=True, exist_ok=True)
+    with closing(sqlite3.connect(_panel_dir(frequency) / "lock.sqlite3", timeout=120, isolation_level=None)) as conn:
+        conn.execute("BEGIN EXCLUSIVE")
+        try:
+            yield
+        finally:
+            conn.execute("ROLLBACK")
+
+
+def _regrow(frequency: str, meta: dict[str, Any], capacity: int) -> None:
+    # Widening changes every row, so live rows are copied once into a new generation of files;
+    # rows orphaned by re-uploads are dropped on the way.
+    old_gen, rows, old_capacity = meta["generation"], meta["row_count"], meta["capacity"]
+    live = sorted(meta["dates"].items(), key=lambda item: item[1])
+    new_gen = old_gen + 1
+    for layer in ("present", *PANEL_LAYERS):
+        dtype = _layer_dtype(layer)
+        fill = 0 if layer == "present" else np.nan
+        old = _map(_layer_path(frequency, old_gen, layer), dtype, rows, old_capacity)
+        with _layer_path(frequency, new_gen, layer).open("wb") as fh:
+            for _, row in live:
+                out = np.full(capacity, fill, dtype=dtype)
+                out[:old_capacity] = old[row]
+                fh.write(out.tobytes())
+        del old
+    meta["dates"] = {date_key: i for i, (date_key, _) in enumerate(live)}
+    meta["generation"], meta["capacity"], meta["row_count"] = new_gen, capacity, len(live)
+
+
+def _append_date(frequency: str, meta: dict[str, Any], date_key: str, source: str, table: pd.DataFrame) -> None:
+    # One value per fund and date: the first row of an ISIN wins, as in the per-file lookups.
+    table = table.drop_duplicates(subset="isin", keep="first")
+    isins = table["isin"].astype(str).tolist()
+    positions = {isin: i for i, isin in enumerate(meta["isins"])}
+    for isin in dict.fromkeys(isins):
+        if isin not in positions:
+            positions[isin] = len(meta["isins"])
+            meta["isins"].append(isin)
+            meta["names"].append(isin)
+    if len(meta["isins"]) > meta["capacity"]:
+        capacity = max(PANEL_MIN_CAPACITY, meta["capacity"])
+        while capacity < len(meta["isins"]):
+            capacity *= 2
+        _regrow(frequency, meta, capacity)
+
+    cols = np.fromiter((positions[isin] for isin in isins), dtype=np.intp, count=len(isins))
+    capacity = meta["capacity"]
+    for layer in ("present", *PANEL_LAYERS):
+        path = _layer_path(frequency, meta["generation"], layer)
+        size = meta["row_count"] * capacity * np.dtype(_layer_dtype(layer)).itemsize
+        if path.exists() and path.stat().st_size > size:
+            # Drop rows left past row_count by an interrupted sync so the new row lands where the index says.
+            with path.open("r+b") as fh:
+                fh.truncate(size)
+        if layer == "present":
+            row = np.zeros(capacity, dtype=np.uint8)
+            row[cols] = 1
+        else:
+            row = np.full(capacity, np.nan)
+            row[cols] = table[layer].to_numpy(dtype="float64")
+        # Rows are only ever appended: readers mapping the previous row_count never see a partial write.
+        with path.open("ab") as fh:
+            fh.write(row.tobytes())
+            fh.flush()
+            os.fsync(fh.fileno())
+    meta["dates"][date_key] = meta["row_count"]
+    meta["sources"][date_key] = source
+    meta["row_count"] += 1
+    if date_key == max(meta["dates"], key=date_key_order):
+        for col, name in zip(cols, table["OPCVM"].astype(str)):
+            meta["names"][col] = name
+
+
+def _in_step(meta: dict[str, Any], date_key: str, source: str) -> bool:
+    # A date is settled once its current workbook is in the panel or has been found unreadable.
+    if date_key in meta["dates"]:
+        return meta["sources"].get(date_key) == source
+    return meta.setdefault("failed", {}).get(date_key) == source
+
+
+def _sync(frequency: str, wanted: dict[str, dict[str, Any]]) -> None:
+    with _writer_lock(frequency):
+        meta = _read_index(frequency)
+        failed = meta.setdefault("failed", {})
+        old_generation = meta["generation"]
+        changed = False
+        for date_key in [d for d in meta["dates"] if d not in wanted]:
+            del meta["dates"][date_key]
+            meta["sources"].pop(date_key, None)
+            changed = True
+        for date_key in [d for d in failed if d not in wanted]:
+            del failed[date_key]
+            changed = True
+        for date_key in sorted(wanted, key=date_key_order):
+            rec = wanted[date_key]
+            source = record_content_hash(rec) or ""
+            if _in_step(meta, date_key, source):
+                continue
+            try:
+                table = load_asfim_table(str(rec["storage_path"]), frequency, source or None, rec.get("layout"))
+            except Exception:
+                # An archived workbook that cannot be read stays out of the panel until it is re-uploaded.
+                meta["dates"].pop(date_key, None)
+                meta["sources"].pop(date_key, None)
+                failed[date_key] = source
+                changed = True
+                continue
+            failed.pop(date_key, None)
+            _append_date(frequency, meta, date_key, source, table)
+            changed = True
+        orphans = meta["row_count"] - len(meta["dates"])
+        if orphans > max(len(meta["dates"]), PANEL_MIN_ORPHANS):
+            _regrow(frequency, meta, meta["capacity"])
+        if changed:
+            meta["revision"] = meta.get("revision", 0) + 1
+            _write_index(frequency, meta)
+            _panel_dir(frequency).with_suffix(".npz").unlink(missing_ok=True)
+        if meta["generation"] != old_generation:
+            for layer in ("present", *PANEL_LAYERS):
+                try:
+                    _layer_path(frequency, old_generation, layer).unlink(missing_ok=True)
+                except OSError:
+                    # Still mapped by another process on Windows; it is reclaimed on a later regrow.
+                    pass
+
+
+def load_panel(frequency: str) -> FundPanel:
+    """Panel in step with the catalog; only dates whose latest upload changed are read and appended."""
+    with _panel_lock:
+        version = history_version()
+        memo = _panel_memo.get(frequency)
+        if memo is not None and memo[0] == version:
+            return memo[1]
+
+        wanted: dict[str, dict[str, Any]] = {}
+        for date_key in list_asfim_dates(frequency):
+            rec = latest_asfim_record(frequency, date_key)
+            if rec is not None:
+                wanted[date_key] = rec
+
+        meta = _read_index(frequency)
+        stale = bool(set(meta["dates"]) - set(wanted)) or not all(
+            _in_step(meta, d, record_content_hash(rec) or "") for d, rec in wanted.items()
+        )
+        if stale:
+            _sync(frequency, wanted)
+        panel = _open_panel(frequency)
+        _panel_memo[frequency] = (version, panel)
+        return panel
@@ -0,0 +1,220 @@
+﻿from __future__ import annotations
+
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable, TypeVar
+
+import pandas as pd
+
+from storage import BASE_DATA_DIR
+
+CACHE_DIR = BASE_DATA_DIR / "cache"
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Writes between two scans of the cache directory; other processes' writes are only seen by a scan.
+CACHE_RESCAN_WRITES = 256
+# Eviction trims to this share of the budget so the next writes do not rescan straight away.
+CACHE_EVICT_TO = 0.8
+
+T = TypeVar("T")
+
+_usage_lock = threading.Lock()
+_usage_bytes: int | None = None
+_writes_since_scan = 0
+
+
+def _entry_path(namespace: str, version: int, key: tuple[Any, ...]) -> Path:
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+    return CACHE_DIR / namespace / f"{digest}.v{version}.pkl"
+
+
+def _evict(max_bytes: int) -> int:
+    entries = []
+    total = 0
+    for path in CACHE_DIR.glob("*/*.pkl"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total += stat.st_size
+    # Reads touch mtime, so the oldest mtime is the least recently used entry.
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+    return total
+
+
+def _record_write(size: int, max_bytes: int) -> None:
+    # The directory is only scanned when this process's running total goes over budget, or
+    # every CACHE_RESCAN_WRITES writes to pick up what other processes added.
+    global _usage_bytes, _writes_since_scan
+    with _usage_lock:
+        if _usage_bytes is None or _writes_since_scan >= CACHE_RESCAN_WRITES:
+            _usage_bytes, _writes_since_scan = _evict(max_bytes), 0
+            return
+        _usage_bytes += size
+        _writes_since_scan += 1
+        if _usage_bytes > max_bytes:
+            _usage_bytes, _writes_since_scan = _evict(int(max_bytes * CACHE_EVICT_TO)), 0
+
+
+def cached(namespace: str, version: int, key: tuple[Any, ...], compute: Callable[[], T]) -> T:
+    """Disk-backed memo shared by every worker process; bump `version` when `compute` changes its output."""
+    path = _entry_path(namespace, version, key)
+    try:
+        with path.open("rb") as fh:
+            value = pickle.load(fh)
+        os.utime(path)
+        return value
+    except FileNotFoundError:
+        pass
+    except Exception:
+        # Truncated or corrupt entry, or one pickled from classes that no longer exist: a miss.
+        try:
+            path.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+    value = compute()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        with tmp_path.open("wb") as fh:
+            pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            size = fh.tell()
+        os.replace(tmp_path, path)
+        _record_write(size, CACHE_MAX_BYTES)
+    except OSError:
+        pass
+    return value
+
+
+def estimate_size(value: Any) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+def _fresh(value: Any) -> Any:
+    # Callers get their own frames and dicts, as they did from st.cache_data.
+    if isinstance(value, pd.DataFrame):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(_fresh(v) for v in value)
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+class MemoryCache:
+    """Process-wide LRU bounded by entry count and approximate bytes, with usage counters."""
+
+    def __init__(self, name: str, max_entries: int, max_bytes: int) -> None:
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], T]) -> T:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _fresh(entry[0])
+            self.misses += 1
+
+        value = compute()
+        size = estimate_size(value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            if size <= self.max_bytes:
+                self._entries[key] = (value, size)
+                self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return _fresh(value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def entry_sizes(self) -> list[tuple[Hashable, int]]:
+        with self._lock:
+            return [(key, size) for key, (_, size) in self._entries.items()]
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            sizes = [size for _, size in self._entries.values()]
+            return {
+                "cache": self.name,
+                "entries": len(sizes),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "largest_entry_bytes": max(sizes, default=0),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_memory_caches: dict[str, MemoryCache] = {}
+_memory_caches_lock = threading.Lock()
+
+
+def memory_cache(name: str, max_entries: int, max_bytes: int) -> MemoryCache:
+    # Lives in this module rather than the Streamlit script, which is re-executed on every rerun.
+    with _memory_caches_lock:
+        cache = _memory_caches.get(name)
+        if cache is None:
+            cache = _memory_caches[name] = MemoryCache(name, max_entries, max_bytes)
+        return cache
+
+
+def memory_cache_stats() -> list[dict[str, Any]]:
+    with _memory_caches_lock:
+        caches = list(_memory_caches.values())
+    return [cache.stats() for cache in caches]
+
+
+def memory_cache_entries(limit: int | None = None) -> list[dict[str, Any]]:
+    """Entries of every memory cache, largest first, with their approximate size."""
+    with _memory_caches_lock:
+        caches = list(_memory_caches.values())
+    rows = [
+        {"cache": cache.name, "key": repr(key), "bytes": size}
+        for cache in caches
+        for key, size in cache.entry_sizes()
+    ]
+    rows.sort(key=lambda r: r["bytes"], reverse=True)
+    return rows[:limit] if limit is not None else rows
+
+
+def clear_memory_caches() -> None:
+    with _memory_caches_lock:
+        caches = list(_memory_caches.values())
+    for cache in caches:
+        cache.clear()
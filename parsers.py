@@ -0,0 +1,648 @@
+﻿from __future__ import annotations
+
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from functools import lru_cache
+from datetime import date, datetime
+from io import BytesIO
+from typing import Any
+from zipfile import BadZipFile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from openpyxl.utils.exceptions import InvalidFileException
+
+HEADER_SCAN_ROWS = 30
+CONTENT_DATE_ROWS = 6
+BAM_HEADER_ROWS = 15
+BAM_VALUE_DATE_ROWS = 300
+BAM_TITLE_ROWS = 8
+# Bump whenever parse_asfim_workbook changes its output: stored tables of older versions are re-derived.
+ASFIM_SCHEMA_VERSION = 2
+# pandas' default na_values: read_excel turns these strings into NaN, hence "" after fillna.
+PANDAS_NA_STRINGS = frozenset(
+    {
+        "",
+        "#N/A",
+        "#N/A N/A",
+        "#NA",
+        "-1.#IND",
+        "-1.#QNAN",
+        "-NaN",
+        "-nan",
+        "1.#IND",
+        "1.#QNAN",
+        "<NA>",
+        "N/A",
+        "NA",
+        "NULL",
+        "NaN",
+        "None",
+        "n/a",
+        "nan",
+        "null",
+    }
+)
+# A data block ends after this many consecutive rows with every mapped column empty.
+ASFIM_BLANK_RUN_STOP = 200
+BAM_CURVE_SCHEMA_VERSION = 1
+
+HEADER_ALIASES = {
+    "Code ISIN": {"code isin", "isin"},
+    "OPCVM": {"opcvm"},
+    "Societe de Gestion": {"societe de gestion", "soci??t?? de gestion"},
+    "Periodicite VL": {"periodicite vl", "p??riodicit?? vl", "periodicite", "p??riodicit??"},
+    "Classification": {"classification", "classe"},
+    "Souscripteurs": {"souscripteurs", "souscripteur"},
+    "AN": {"an"},
+    "VL": {"vl"},
+    "YTD": {"ytd", "yield", "yld"},
+    "1 jour": {"1 jour", "1j", "1 journee", "1 journ??e"},
+    "1 semaine": {"1 semaine", "1 sem", "1semaine"},
+}
+
+
+# alias -> canonical header, first canonical wins like the original per-alias scan.
+_ALIAS_TO_CANONICAL: dict[str, str] = {}
+for _canonical, _aliases in HEADER_ALIASES.items():
+    for _alias in _aliases:
+        _ALIAS_TO_CANONICAL.setdefault(_alias, _canonical)
+
+_REQUIRED_HEADERS = {
+    frequency: frozenset(
+        {
+            "Code ISIN",
+            "OPCVM",
+            "Societe de Gestion",
+            "Periodicite VL",
+            "Classification",
+            "Souscripteurs",
+            "AN",
+            "VL",
+            "YTD",
+            "1 jour" if frequency == "quotidien" else "1 semaine",
+        }
+    )
+    for frequency in ("quotidien", "hebdomadaire")
+}
+
+_WHITESPACE = re.compile(r"\s+")
+# Combining marks NFKD yields for accented Latin letters; rarer marks go through the generic filter.
+_LATIN_COMBINING = {cp: None for cp in range(0x0300, 0x0370) if unicodedata.combining(chr(cp))}
+
+
+def _strip_accents(text: str) -> str:
+    if text.isascii():
+        return text
+    text = unicodedata.normalize("NFKD", text).translate(_LATIN_COMBINING)
+    if not text.isascii():
+        text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return text
+
+
+@lru_cache(maxsize=8192)
+def _norm_header_text(text: str) -> str:
+    text = text.strip().lower().replace("\u00a0", " ")
+    # Repair mojibake punctuation. The "Ã.." letter sequences can no longer occur once lower() has run.
+    if "\u00e2\u20ac" in text:
+        text = text.replace("\u00e2\u20ac\u2122", "'").replace("\u00e2\u20ac\u00a2", "")
+    # Remove accents so matching works with both accented/non-accented headers.
+    return _WHITESPACE.sub(" ", _strip_accents(text))
+
+
+def norm_col(value: object) -> str:
+    return _norm_header_text("" if value is None else str(value))
+
+
+def to_num(value: object) -> float | None:
+    if value is None:
+        return None
+    txt = str(value).strip().replace("\u00a0", "")
+    if not txt:
+        return None
+    txt = txt.replace("%", "").replace(" ", "").replace(",", ".")
+    try:
+        return float(txt)
+    except ValueError:
+        return None
+
+
+_PLAIN_NUMBER = r"^[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?$"
+
+
+def to_num_series(values: pd.Series) -> pd.Series:
+    """Column-wise to_num: the same float for every cell, NaN where to_num returns None."""
+    if pd.api.types.is_bool_dtype(values):
+        return pd.Series(np.nan, index=values.index, dtype="float64")
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype("float64")
+
+    cells = values.to_numpy(dtype=object)
+    try:
+        text = pa.array(cells, type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        text = pa.array([str(v) for v in cells], type=pa.string())
+    # Same steps as to_num, run as Arrow kernels over the whole column.
+    text = pc.utf8_trim_whitespace(text)
+    for old, new in (("\u00a0", ""), ("%", ""), (" ", ""), (",", ".")):
+        text = pc.replace_substring(text, old, new)
+    plain = pc.fill_null(pc.match_substring_regex(text, _PLAIN_NUMBER), False)
+    # Arrow's float parser rounds correctly, like float(), so plain decimals come out bit-identical.
+    out = pc.cast(pc.if_else(plain, text, pa.scalar(None, pa.string())), pa.float64()).to_numpy(zero_copy_only=False)
+
+    # Anything float() might still accept ("inf", "1_000", other digit sets) takes the scalar path.
+    rest = pc.and_(pc.invert(plain), pc.fill_null(pc.not_equal(text, ""), False)).to_numpy(zero_copy_only=False)
+    if rest.any():
+        out[rest] = values[rest].map(to_num).astype("float64").to_numpy()
+    return pd.Series(out, index=values.index, dtype="float64")
+
+
+def match_header_row(values: list[object], frequency: str) -> dict[int, str] | None:
+    mapped: dict[int, str] = {}
+    for i, v in enumerate(values):
+        canonical = _ALIAS_TO_CANONICAL.get(norm_col(v))
+        if canonical is not None:
+            mapped[i] = canonical
+
+    required = _REQUIRED_HEADERS["quotidien" if frequency == "quotidien" else "hebdomadaire"]
+    if required.issubset(mapped.values()):
+        return mapped
+    return None
+
+
+def detect_headers(raw: pd.DataFrame, frequency: str) -> tuple[int, dict[int, str]] | tuple[None, None]:
+    for r in range(min(HEADER_SCAN_ROWS, len(raw))):
+        mapped = match_header_row(raw.iloc[r].tolist(), frequency)
+        if mapped is not None:
+            return r, mapped
+    return None, None
+
+
+def extract_date_from_text(text: str) -> str | None:
+    if not text:
+        return None
+    m1 = re.search(r"(\d{2}[/-]\d{2}[/-]\d{4})", text)
+    if m1:
+        raw = m1.group(1).replace("-", "/")
+        try:
+            return datetime.strptime(raw, "%d/%m/%Y").strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+    m2 = re.search(r"(\d{4}-\d{2}-\d{2})", text)
+    if m2:
+        try:
+            return datetime.strptime(m2.group(1), "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+    return None
+
+
+@dataclass
+class WorkbookSniff:
+    """What one read-only pass over the first sheet tells us about an upload."""
+
+    content_date: str | None = None
+    bam_value_date: str | None = None
+    sheet: str | None = None
+    header_row: int | None = None
+    columns: dict[int, str] = field(default_factory=dict)
+
+    def layout(self) -> dict[str, Any] | None:
+        if self.sheet is None or self.header_row is None:
+            return None
+        return {
+            "sheet": self.sheet,
+            "header_row": self.header_row,
+            "columns": {str(i): name for i, name in self.columns.items()},
+        }
+
+
+def _first_sheet_rows(file_bytes: bytes, limit: int) -> tuple[str, list[tuple[object, ...]]]:
+    wb = load_workbook(BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        sheet = wb.sheetnames[0]
+        rows: list[tuple[object, ...]] = []
+        for row in wb[sheet].iter_rows(values_only=True):
+            rows.append(row)
+            if len(rows) >= limit:
+                break
+        return sheet, rows
+    finally:
+        wb.close()
+
+
+def _content_date(rows: list[tuple[object, ...]]) -> str | None:
+    for values in rows[:CONTENT_DATE_ROWS]:
+        text = " ".join(str(v) for v in values if v is not None)
+        match = re.search(r"(\d{2}[/-]\d{2}[/-]\d{4})", text)
+        if match:
+            raw = match.group(1).replace("-", "/")
+            try:
+                return datetime.strptime(raw, "%d/%m/%Y").strftime("%Y-%m-%d")
+            except ValueError:
+                return None
+    return None
+
+
+def _bam_value_date(rows: list[tuple[object, ...]]) -> str | None:
+    header_row = None
+    date_col = None
+    for r, values in enumerate(rows[:BAM_HEADER_ROWS]):
+        for i, v in enumerate(values):
+            norm = ("" if v is None else str(v)).strip().lower()
+            if norm in {"date de la valeur", "date de valeur"}:
+                header_row = r
+                date_col = i
+                break
+        if header_row is not None:
+            break
+
+    if header_row is not None and date_col is not None:
+        counts: dict[str, int] = {}
+        for values in rows[header_row + 1 : header_row + 1 + BAM_VALUE_DATE_ROWS]:
+            val = values[date_col] if date_col < len(values) else None
+            parsed = extract_date_from_text("" if val is None else str(val))
+            if parsed:
+                counts[parsed] = counts.get(parsed, 0) + 1
+        if counts:
+            return sorted(counts.items(), key=lambda x: (-x[1], x[0]))[0][0]
+
+    for values in rows[:BAM_TITLE_ROWS]:
+        parsed = extract_date_from_text(" ".join("" if v is None else str(v) for v in values))
+        if parsed:
+            return parsed
+    return None
+
+
+def sniff_workbook(file_bytes: bytes, kind: str = "asfim", frequency: str | None = None) -> WorkbookSniff:
+    """Stream the top of the first sheet once: content dates plus, for ASFIM, the header layout."""
+    limit = BAM_HEADER_ROWS + 1 + BAM_VALUE_DATE_ROWS if kind == "bam" else HEADER_SCAN_ROWS
+    try:
+        sheet, rows = _first_sheet_rows(file_bytes, limit)
+    except Exception:
+        return WorkbookSniff()
+
+    sniff = WorkbookSniff(content_date=_content_date(rows))
+    if kind == "bam":
+        sniff.bam_value_date = _bam_value_date(rows)
+    elif frequency:
+        for r, values in enumerate(rows[:HEADER_SCAN_ROWS]):
+            mapped = match_header_row(list(values), frequency)
+            if mapped is not None:
+                sniff.sheet, sniff.header_row, sniff.columns = sheet, r, mapped
+                break
+    return sniff
+
+
+def perf_column_name(frequency: str) -> str:
+    return "Performance quotidienne" if frequency == "quotidien" else "Performance hebdomadaire"
+
+
+# Display columns stay as the raw text of the workbook; these hold their parsed values.
+NUMERIC_COLUMNS = {
+    "AN": "an_num",
+    "VL": "vl_num",
+    "YTD": "ytd_num",
+    "Performance quotidienne": "performance_num",
+    "Performance hebdomadaire": "performance_num",
+}
+
+
+def asfim_columns(frequency: str) -> list[str]:
+    return [
+        "Code ISIN",
+        "OPCVM",
+        "Soci??t?? de Gestion",
+        "P??riodicit?? VL",
+        "Classification",
+        "Souscripteurs",
+        "AN",
+        "VL",
+        "YTD",
+        perf_column_name(frequency),
+        "performance_num",
+        "isin",
+        "an_num",
+        "vl_num",
+        "ytd_num",
+    ]
+
+
+def _with_typed_columns(out: pd.DataFrame, perf_name: str) -> pd.DataFrame:
+    out["performance_num"] = to_num_series(out[perf_name])
+    out["isin"] = out["Code ISIN"].astype(str).str.strip().str.upper().astype("category")
+    out["an_num"] = to_num_series(out["AN"])
+    out["vl_num"] = to_num_series(out["VL"])
+    out["ytd_num"] = to_num_series(out["YTD"])
+    return out
+
+
+def empty_asfim_table(frequency: str) -> pd.DataFrame:
+    columns = asfim_columns(frequency)
+    return _with_typed_columns(pd.DataFrame(columns=columns[:10], dtype=object), perf_column_name(frequency))
+
+
+_STANDARD_COLUMN_NAMES = {
+    "societe de gestion": "Société de Gestion",
+    "periodicite vl": "Périodicité VL",
+    "code isin": "Code ISIN",
+    "opcvm": "OPCVM",
+    "classification": "Classification",
+    "souscripteurs": "Souscripteurs",
+    "souscripteur": "Souscripteurs",
+    "an": "AN",
+    "vl": "VL",
+    "ytd": "YTD",
+    "yield": "YTD",
+    "yld": "YTD",
+    "maturite": "Maturité",
+}
+
+
+def _standardize_asfim_columns(df: pd.DataFrame) -> pd.DataFrame:
+    out = df.copy()
+    rename_map: dict[str, str] = {}
+    for col in out.columns:
+        standard = _STANDARD_COLUMN_NAMES.get(norm_col(col))
+        if standard is not None:
+            rename_map[col] = standard
+    if rename_map:
+        out = out.rename(columns=rename_map)
+    return out
+
+
+def _asfim_table_from_body(body: pd.DataFrame, frequency: str) -> pd.DataFrame | None:
+    perf_col = "1 jour" if frequency == "quotidien" else "1 semaine"
+    body = body.fillna("")
+    body = body[body["Code ISIN"].astype(str).str.strip() != ""]
+
+    body = _standardize_asfim_columns(body)
+
+    def col_for(norm_name: str) -> str | None:
+        for c in body.columns:
+            if norm_col(c) == norm_name:
+                return c
+        return None
+
+    required = {
+        "code isin": col_for("code isin"),
+        "opcvm": col_for("opcvm"),
+        "societe de gestion": col_for("societe de gestion"),
+        "periodicite vl": col_for("periodicite vl"),
+        "classification": col_for("classification"),
+        "souscripteurs": col_for("souscripteurs"),
+        "an": col_for("an"),
+        "vl": col_for("vl"),
+        "ytd": col_for("ytd"),
+        "perf": col_for(norm_col(perf_col)),
+    }
+    if any(v is None for v in required.values()):
+        return None
+
+    perf_name = perf_column_name(frequency)
+    out = pd.DataFrame(
+        {
+            "Code ISIN": body[required["code isin"]],
+            "OPCVM": body[required["opcvm"]],
+            "Soci??t?? de Gestion": body[required["societe de gestion"]],
+            "P??riodicit?? VL": body[required["periodicite vl"]],
+            "Classification": body[required["classification"]],
+            "Souscripteurs": body[required["souscripteurs"]],
+            "AN": body[required["an"]],
+            "VL": body[required["vl"]],
+            "YTD": body[required["ytd"]],
+            perf_name: body[required["perf"]],
+        }
+    )
+    return _with_typed_columns(out, perf_name)
+
+
+def _layout_mapping(layout: dict[str, Any]) -> tuple[int, dict[int, str]]:
+    return int(layout["header_row"]), {int(i): name for i, name in layout["columns"].items()}
+
+
+def _cell_text(value: object) -> str:
+    # Same text pandas yields for read_excel(header=None, dtype=str).fillna("") on an openpyxl cell.
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        if value in ERROR_CODES or value in PANDAS_NA_STRINGS:
+            return ""
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        as_int = int(value)
+        return str(as_int) if as_int == value else str(float(value))
+    return str(value)
+
+
+def _stream_asfim_body(ws: Any, frequency: str, layout: dict[str, Any] | None) -> pd.DataFrame | None:
+    ws.reset_dimensions()
+    rows = enumerate(ws.iter_rows(values_only=True))
+
+    if layout is not None:
+        header_row, mapped = _layout_mapping(layout)
+        for r, _ in rows:
+            if r >= header_row:
+                break
+    else:
+        header_row, mapped = None, None
+        for r, values in rows:
+            if r >= HEADER_SCAN_ROWS:
+                break
+            found = match_header_row([_cell_text(v) for v in values], frequency)
+            if found is not None:
+                header_row, mapped = r, found
+                break
+        if mapped is None:
+            return None
+
+    keep = sorted(mapped.items(), key=lambda x: x[0])
+    idxs = [i for i, _ in keep]
+    isin_pos = [name for _, name in keep].index("Code ISIN") if "Code ISIN" in mapped.values() else None
+    index: list[int] = []
+    data: list[list[str]] = []
+    blank_run = 0
+    for r, values in rows:
+        width = len(values)
+        picked = [_cell_text(values[i]) if i < width else "" for i in idxs]
+        if not any(picked):
+            blank_run += 1
+            if blank_run >= ASFIM_BLANK_RUN_STOP:
+                break
+            continue
+        blank_run = 0
+        if isin_pos is not None and not picked[isin_pos].strip():
+            continue
+        index.append(r)
+        data.append(picked)
+    return pd.DataFrame(data, index=pd.Index(index, dtype="int64"), columns=[name for _, name in keep], dtype=object)
+
+
+def _parse_asfim_with_pandas(source: Any, frequency: str, layout: dict[str, Any] | None) -> pd.DataFrame | None:
+    xls = pd.ExcelFile(source)
+    hint = layout if layout and layout.get("sheet") in xls.sheet_names else None
+    for sheet in xls.sheet_names:
+        raw = xls.parse(sheet_name=sheet, header=None, dtype=str).fillna("")
+        if hint is not None and sheet == hint["sheet"]:
+            header_row, mapped = _layout_mapping(hint)
+        else:
+            header_row, mapped = detect_headers(raw, frequency)
+        if header_row is None or mapped is None:
+            continue
+
+        keep = sorted(mapped.items(), key=lambda x: x[0])
+        body = raw.iloc[header_row + 1 :].copy()
+        body = body.iloc[:, [i for i, _ in keep]]
+        body.columns = [name for _, name in keep]
+        out = _asfim_table_from_body(body, frequency)
+        if out is not None:
+            return out
+    return None
+
+
+def parse_asfim_workbook(source: Any, frequency: str, layout: dict[str, Any] | None = None) -> pd.DataFrame:
+    """Parse an ASFIM workbook (path or bytes) into the canonical fund table.
+
+    Sheets are streamed row by row; only the mapped columns of the data block are kept.
+    Workbooks openpyxl cannot open go through pandas instead.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    try:
+        wb = load_workbook(source, read_only=True, data_only=True)
+    except (InvalidFileException, BadZipFile, KeyError):
+        if hasattr(source, "seek"):
+            source.seek(0)
+        out = _parse_asfim_with_pandas(source, frequency, layout)
+        return out if out is not None else empty_asfim_table(frequency)
+
+    try:
+        hint = layout if layout and layout.get("sheet") in wb.sheetnames else None
+        for sheet in wb.sheetnames:
+            ws = wb[sheet]
+            if not hasattr(ws, "iter_rows"):
+                continue
+            body = _stream_asfim_body(ws, frequency, hint if hint is not None and sheet == hint["sheet"] else None)
+            if body is None:
+                continue
+            out = _asfim_table_from_body(body, frequency)
+            if out is not None:
+                return out
+    finally:
+        wb.close()
+    return empty_asfim_table(frequency)
+
+
+@lru_cache(maxsize=1024)
+def _norm_bam_text(text: str) -> str:
+    t = text.strip().lower().replace("\u00a0", " ")
+    t = t.replace("’", "'")
+    # Remove accents robustly (é -> e, etc.) for BAM header matching.
+    return _WHITESPACE.sub(" ", _strip_accents(t))
+
+
+def norm_bam_col(v: str) -> str:
+    return _norm_bam_text(str(v))
+
+
+def parse_dt_any(v: object) -> date | None:
+    if v is None:
+        return None
+    s = str(v).strip()
+    if not s:
+        return None
+    for dayfirst in (True, False):
+        d = pd.to_datetime(s, dayfirst=dayfirst, errors="coerce")
+        if pd.notna(d):
+            return d.date()
+    return None
+
+
+# Tried in order, each on what the previous ones left unparsed. The order reproduces what
+# pd.to_datetime(dayfirst=True) does to these shapes, including reading ISO text as year-day-month
+# whenever that gives a valid date.
+BAM_DATE_FORMATS = (
+    "%Y-%d-%m %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%d-%m",
+    "%Y-%m-%d",
+    "%d/%m/%Y",
+    "%m/%d/%Y",
+    "%d-%m-%Y",
+)
+
+
+def parse_dates(values: pd.Series) -> pd.Series:
+    """Column-wise parse_dt_any: midnight datetime64 values, NaT where parse_dt_any returns None."""
+    text = values.astype(str).str.strip()
+    out = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+    pending = (text != "").to_numpy(dtype=bool)
+    for fmt in BAM_DATE_FORMATS:
+        if not pending.any():
+            break
+        parsed = pd.to_datetime(text[pending], format=fmt, errors="coerce")
+        hit = parsed.notna().to_numpy(dtype=bool)
+        if hit.any():
+            rows = pending.nonzero()[0][hit]
+            out.iloc[rows] = parsed[hit].dt.normalize().to_numpy()
+            pending[rows] = False
+    if pending.any():
+        rest = pd.to_datetime(values[pending].map(parse_dt_any), errors="coerce")
+        out.iloc[pending.nonzero()[0]] = rest.to_numpy(dtype="datetime64[ns]")
+    return out
+
+
+def parse_bam_curve(source: Any) -> tuple[pd.DataFrame, str | None]:
+    """Maturity/rate points of a BAM workbook (path or bytes) and its value date."""
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    xls = pd.ExcelFile(source)
+    for sheet in xls.sheet_names:
+        df = xls.parse(sheet_name=sheet, dtype=str).fillna("")
+        if df.empty:
+            continue
+        cols = list(df.columns)
+        m_col = None
+        t_col = None
+        v_col = None
+        for c in cols:
+            n = norm_bam_col(str(c))
+            if "date d'echeance" in n or "date d'cheance" in n or "echeance" in n:
+                m_col = c
+            if "taux moyen pondere" in n or n == "taux":
+                t_col = c
+            if "date de la valeur" in n or "date de valeur" in n:
+                v_col = c
+        if not (m_col and t_col):
+            continue
+        work = df[[m_col, t_col] + ([v_col] if v_col else [])].copy()
+        work.columns = ["DateEcheance", "Taux"] + (["DateValeur"] if v_col else [])
+        work = work[work["DateEcheance"].astype(str).str.strip() != ""]
+        if work.empty:
+            continue
+        if "DateValeur" in work.columns:
+            vals = parse_dates(work["DateValeur"]).dropna()
+            if vals.empty:
+                continue
+            mode_vals = vals.mode()
+            if mode_vals.empty:
+                continue
+            date_valeur = mode_vals.iloc[0]
+        else:
+            continue
+        work["DateEcheance_dt"] = parse_dates(work["DateEcheance"])
+        work["maturity_days"] = (work["DateEcheance_dt"] - date_valeur).dt.days
+        work["rate_num"] = to_num_series(work["Taux"])
+        work = work.dropna(subset=["maturity_days", "rate_num"])
+        work = work[work["maturity_days"] > 0]
+        if work.empty:
+            continue
+        # Convert percent-like values to decimal rates for interpolation.
+        work["rate_dec"] = work["rate_num"].map(lambda x: x / 100.0 if x > 1 else x)
+        return work[["maturity_days", "rate_dec"]].sort_values("maturity_days"), date_valeur.strftime("%Y-%m-%d")
+    return pd.DataFrame(columns=["maturity_days", "rate_dec"]), None
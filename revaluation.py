@@ -0,0 +1,195 @@
+﻿from __future__ import annotations
+
+import os
+import sys
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Mapping, Sequence
+
+import numpy as np
+import pandas as pd
+
+from parse_cache import cached
+from parsers import BAM_CURVE_SCHEMA_VERSION, parse_bam_curve
+from storage import BASE_DATA_DIR, date_key_order, latest_bam_record, list_bam_dates, record_content_hash
+from vba_finance import BOND_FIELDS, normalize_bond, prix_amortissable_batch
+
+REVALUATION_DIR = BASE_DATA_DIR / "revaluation"
+PARALLEL_REVALUATION_MIN_DATES = 4
+USAGE = "usage: python revaluation.py inventaire.xlsx|inventaire.csv [nom] [workers]"
+
+_revaluation_lock = threading.Lock()
+
+
+def _load_curve(path: str, content_hash: str) -> tuple[pd.DataFrame, str | None]:
+    # Same disk cache as the curve page, so each BAM file is read from Excel once across processes.
+    if not content_hash:
+        return parse_bam_curve(path)
+    return cached("bam_curve", BAM_CURVE_SCHEMA_VERSION, (content_hash,), lambda: parse_bam_curve(path))
+
+
+def _price_date(path: str, content_hash: str, bonds: list[dict[str, Any]]) -> list[float]:
+    """Prices of `bonds` on the curve of one BAM file; NaN outside [emission, echeance) or on failure."""
+    prices = [np.nan] * len(bonds)
+    try:
+        curve, dstr = _load_curve(path, content_hash)
+    except Exception:
+        # The archive keeps BAM files it could not parse (dated by name or batch); they price nothing.
+        return prices
+    if curve.empty or not dstr:
+        return prices
+    mt = [int(v) for v in curve["maturity_days"].tolist()]
+    tx = [float(v) for v in curve["rate_dec"].tolist()]
+    date_valeur = datetime.strptime(dstr, "%Y-%m-%d").date()
+
+    live = [i for i, bond in enumerate(bonds) if bond["date_emission"] <= date_valeur < bond["date_echeance"]]
+    try:
+        results = prix_amortissable_batch([bonds[i] for i in live], date_valeur, mt, tx)
+    except (ArithmeticError, TypeError, ValueError):
+        # One bond the VBA formulas cannot price (e.g. a complex zero-coupon rate): isolate it.
+        results = []
+        for i in live:
+            try:
+                results.extend(prix_amortissable_batch([bonds[i]], date_valeur, mt, tx))
+            except (ArithmeticError, TypeError, ValueError):
+                results.append(None)
+    for i, result in zip(live, results):
+        if result is not None:
+            prices[i] = float(result.prix)
+    return prices
+
+
+def _matrix_path(name: str) -> Path:
+    return REVALUATION_DIR / f"{name}.npz"
+
+
+def _read_matrix(name: str) -> dict[str, Any]:
+    try:
+        with np.load(_matrix_path(name), allow_pickle=False) as saved:
+            return {
+                "bonds": dict(zip(saved["bonds"].tolist(), saved["fingerprints"].tolist())),
+                "dates": dict(zip(saved["dates"].tolist(), saved["sources"].tolist())),
+                "prices": saved["prices"],
+            }
+    except (OSError, KeyError, ValueError):
+        return {"bonds": {}, "dates": {}, "prices": np.zeros((0, 0))}
+
+
+def _write_matrix(name: str, bonds: dict[str, str], dates: dict[str, str], prices: np.ndarray) -> None:
+    """Replace the saved matrix of `name` with this one.
+
+    The file is rewritten whole: an npz archive cannot be appended to, and new dates land
+    between existing ones whenever a late BAM file arrives. At 8 bytes per price this costs
+    far less than pricing a single new date, and it only runs when something was repriced
+    or the inventory or the dates changed.
+    """
+    path = _matrix_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    with tmp_path.open("wb") as fh:
+        np.savez(
+            fh,
+            bonds=np.asarray(list(bonds), dtype=str),
+            fingerprints=np.asarray(list(bonds.values()), dtype=str),
+            dates=np.asarray(list(dates), dtype=str),
+            sources=np.asarray(list(dates.values()), dtype=str),
+            prices=prices,
+        )
+    os.replace(tmp_path, path)
+
+
+def revalue_bonds(
+    name: str,
+    bonds: Sequence[Mapping[str, Any]],
+    id_field: str = "id",
+    max_workers: int | None = None,
+) -> pd.DataFrame:
+    """Price of every bond at every archived BAM date, as a (bond x date) frame persisted under `name`.
+
+    Each bond carries `id_field` and the BOND_FIELDS of prix_amortissable_batch. Only what
+    changed since the last run is priced: every bond on a new or re-uploaded BAM date, and
+    new or edited bonds on the other dates. Dates are fanned out over a process pool, each
+    worker building its date's curve and ladder once for all the bonds it prices.
+    """
+    inventory = {str(bond[id_field]): normalize_bond(bond) for bond in bonds}
+    fingerprints = {bond_id: repr(sorted(values.items())) for bond_id, values in inventory.items()}
+    wanted: dict[str, tuple[str, str]] = {}
+    for date_key in list_bam_dates():
+        rec = latest_bam_record(date_key)
+        if rec is not None:
+            wanted[date_key] = (str(rec["storage_path"]), record_content_hash(rec) or "")
+
+    with _revaluation_lock:
+        saved = _read_matrix(name)
+        old_rows = {bond_id: i for i, bond_id in enumerate(saved["bonds"])}
+        old_cols = {date_key: j for j, date_key in enumerate(saved["dates"])}
+        kept = [b for b in inventory if saved["bonds"].get(b) == fingerprints[b]]
+        kept_set = set(kept)
+        changed = [b for b in inventory if b not in kept_set]
+        dates = sorted(wanted, key=date_key_order)
+        prices = np.full((len(inventory), len(dates)), np.nan)
+        row_of = {bond_id: i for i, bond_id in enumerate(inventory)}
+        kept_new = np.fromiter((row_of[b] for b in kept), dtype=np.intp, count=len(kept))
+        kept_old = np.fromiter((old_rows[b] for b in kept), dtype=np.intp, count=len(kept))
+
+        tasks: list[tuple[str, list[str]]] = []
+        reused_new: list[int] = []
+        reused_old: list[int] = []
+        for j, date_key in enumerate(dates):
+            source = wanted[date_key][1]
+            if date_key in old_cols and source and saved["dates"][date_key] == source:
+                reused_new.append(j)
+                reused_old.append(old_cols[date_key])
+                todo = changed
+            else:
+                todo = list(inventory)
+            if todo:
+                tasks.append((date_key, todo))
+        if kept and reused_new:
+            prices[np.ix_(kept_new, reused_new)] = saved["prices"][np.ix_(kept_old, reused_old)]
+
+        args = (
+            [wanted[d][0] for d, _ in tasks],
+            [wanted[d][1] for d, _ in tasks],
+            [[inventory[b] for b in todo] for _, todo in tasks],
+        )
+        if len(tasks) < PARALLEL_REVALUATION_MIN_DATES or max_workers == 1:
+            priced = list(map(_price_date, *args))
+        else:
+            workers = min(len(tasks), max_workers or os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                priced = list(pool.map(_price_date, *args))
+
+        col_of = {date_key: j for j, date_key in enumerate(dates)}
+        for (date_key, todo), values in zip(tasks, priced):
+            prices[[row_of[b] for b in todo], col_of[date_key]] = values
+
+        if tasks or set(saved["bonds"]) != set(inventory) or set(saved["dates"]) != set(dates):
+            _write_matrix(name, fingerprints, {d: wanted[d][1] for d in dates}, prices)
+    return pd.DataFrame(prices, index=pd.Index(list(inventory), name=id_field), columns=dates)
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        raise SystemExit(USAGE)
+    path = Path(sys.argv[1])
+    name = sys.argv[2] if len(sys.argv) > 2 else path.stem
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    table = pd.read_csv(path) if path.suffix.lower() == ".csv" else pd.read_excel(path)
+    for col in ("date_emission", "date_echeance", "date_jouissance"):
+        if col in table.columns:
+            table[col] = pd.to_datetime(table[col])
+    missing = [c for c in ("id", *BOND_FIELDS) if c not in table.columns and c != "date_jouissance"]
+    if missing:
+        raise SystemExit(f"{path}: colonnes manquantes {missing}")
+
+    matrix = revalue_bonds(name, table.to_dict("records"), max_workers=workers)
+    print(f"{name}: {matrix.shape[0]} obligations x {matrix.shape[1]} dates BAM, {int(matrix.notna().sum().sum())} prix")
+
+
+if __name__ == "__main__":
+    main()
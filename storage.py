@@ -1,12 +1,24 @@
 ﻿from __future__ import annotations
 
+import hashlib
 import json
+import multiprocessing
+import os
 import re
+import sqlite3
+import sys
+import threading
+import types
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing, contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator
 
-from openpyxl import load_workbook
+import pandas as pd
+
+from parsers import ASFIM_SCHEMA_VERSION, WorkbookSniff, parse_asfim_workbook, sniff_workbook
 
 BASE_DATA_DIR = Path("data")
 ASFIM_BASE_DIR = BASE_DATA_DIR / "asfim"
@@ -15,45 +27,428 @@ ASFIM_DIRS = {
     "hebdomadaire": ASFIM_BASE_DIR / "hebdomadaire",
 }
 BAM_BASE_DIR = BASE_DATA_DIR / "bam"
+# Uploaded workbooks are stored once, under the SHA-256 of their bytes.
+BLOB_DIR = BASE_DATA_DIR / "blobs"
 DB_DIR = BASE_DATA_DIR / "db"
 HISTORY_PATH = DB_DIR / "history.json"
+JOURNAL_PATH = DB_DIR / "history.jsonl"
+CATALOG_PATH = DB_DIR / "catalog.sqlite3"
+
+# history.json is the compacted snapshot, history.jsonl the append-only journal written on
+# every upload; the SQLite catalog is the query index rebuilt from both when needed.
+JOURNAL_COMPACT_BYTES = 512 * 1024
+# Bulk uploads from this size on are sniffed in a process pool.
+PARALLEL_INGEST_MIN_FILES = 4
+
+_catalog_ready = False
+
+# Process-wide read index shared by every Streamlit session; see _history_index().
+_index_lock = threading.Lock()
+_index: dict[str, Any] | None = None
+_reader = threading.local()
+_hash_memo: dict[tuple[str, int, int], str] = {}
+
+# PRAGMA user_version of the catalog; 1 added items.record_id.
+CATALOG_SCHEMA_VERSION = 1
+_CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    record_id TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    frequency TEXT NOT NULL DEFAULT '',
+    date_key TEXT NOT NULL DEFAULT '',
+    uploaded_at TEXT NOT NULL DEFAULT '',
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_items_kind_freq_date_upload
+    ON items (kind, frequency, date_key, uploaded_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
 
 
 def init_storage() -> None:
+    global _catalog_ready
     BASE_DATA_DIR.mkdir(parents=True, exist_ok=True)
     ASFIM_BASE_DIR.mkdir(parents=True, exist_ok=True)
     BAM_BASE_DIR.mkdir(parents=True, exist_ok=True)
+    BLOB_DIR.mkdir(parents=True, exist_ok=True)
     DB_DIR.mkdir(parents=True, exist_ok=True)
     for folder in ASFIM_DIRS.values():
         folder.mkdir(parents=True, exist_ok=True)
-    if not HISTORY_PATH.exists():
-        HISTORY_PATH.write_text(
-            json.dumps({"version": 1, "items": []}, ensure_ascii=False, indent=2),
-            encoding="utf-8",
+    with closing(_connect()) as conn:
+        # WAL lets every Streamlit session read while an upload is being committed.
+        conn.execute("PRAGMA journal_mode=WAL")
+        if _catalog_settled(conn):
+            # The usual case on every Streamlit rerun: no write lock, no version bump.
+            _catalog_ready = True
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _migrate_catalog(conn)
+            seeded = _load_snapshot(conn)
+            replayed = _replay_journal(conn)
+            if seeded or replayed:
+                _bump_version(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    _catalog_ready = True
+
+
+def _catalog_settled(conn: sqlite3.Connection) -> bool:
+    # Nothing to migrate, seed or replay: read-only checks, safe without the write lock.
+    if conn.execute("PRAGMA user_version").fetchone()[0] < CATALOG_SCHEMA_VERSION:
+        return False
+    if not conn.execute("SELECT 1 FROM meta WHERE key = 'snapshot_loaded'").fetchone():
+        return False
+    try:
+        size = JOURNAL_PATH.stat().st_size
+    except FileNotFoundError:
+        size = 0
+    return _stored_journal_offset(conn) == size
+
+
+def _create_schema(conn: sqlite3.Connection) -> None:
+    # Statement by statement: executescript would commit the caller's transaction.
+    for statement in _CATALOG_SCHEMA.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def _migrate_catalog(conn: sqlite3.Connection) -> None:
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= CATALOG_SCHEMA_VERSION:
+        return
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(items)")}
+    if columns and "record_id" not in columns:
+        # Catalog from before record ids: rebuild items, deriving ids as for legacy snapshot items.
+        payloads = [json.loads(p) for (p,) in conn.execute("SELECT payload FROM items ORDER BY id").fetchall()]
+        conn.execute("DROP INDEX IF EXISTS idx_items_kind_freq_date_upload")
+        conn.execute("ALTER TABLE items RENAME TO items_v0")
+        _create_schema(conn)
+        _insert_records(conn, payloads)
+        conn.execute("DROP TABLE items_v0")
+        # Its history.json was imported under the old marker name.
+        conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) "
+            "SELECT 'snapshot_loaded', value FROM meta WHERE key = 'json_migrated'"
         )
+    else:
+        _create_schema(conn)
+    conn.execute(f"PRAGMA user_version = {CATALOG_SCHEMA_VERSION}")
 
 
-def load_history() -> dict[str, Any]:
-    init_storage()
+def _ensure_catalog() -> None:
+    if not _catalog_ready or not CATALOG_PATH.exists():
+        init_storage()
+
+
+def _connect() -> sqlite3.Connection:
+    return sqlite3.connect(CATALOG_PATH, timeout=30)
+
+
+def _read_json_history() -> list[dict[str, Any]]:
+    if not HISTORY_PATH.exists():
+        return []
     try:
         payload = json.loads(HISTORY_PATH.read_text(encoding="utf-8"))
     except json.JSONDecodeError:
-        payload = {"version": 1, "items": []}
-    if "items" not in payload or not isinstance(payload["items"], list):
-        payload["items"] = []
-    if "version" not in payload:
-        payload["version"] = 1
-    return payload
+        return []
+    items = payload.get("items") if isinstance(payload, dict) else None
+    if not isinstance(items, list):
+        return []
+    return [i for i in items if isinstance(i, dict)]
+
+
+def _load_snapshot(conn: sqlite3.Connection) -> bool:
+    # The snapshot (including a legacy history.json) seeds a fresh catalog once.
+    done = conn.execute("SELECT 1 FROM meta WHERE key = 'snapshot_loaded'").fetchone()
+    if done:
+        return False
+    before = conn.total_changes
+    _insert_records(conn, _read_json_history())
+    seeded = conn.total_changes != before
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES ('snapshot_loaded', ?)",
+        (datetime.now().isoformat(timespec="seconds"),),
+    )
+    return seeded
+
+
+def _read_journal(offset: int = 0) -> tuple[list[dict[str, Any]], int]:
+    """Entries appended from byte `offset` on, and the offset just past the last complete line."""
+    if not JOURNAL_PATH.exists():
+        return [], 0
+    with JOURNAL_PATH.open("rb") as fh:
+        fh.seek(offset)
+        data = fh.read()
+    end = data.rfind(b"\n") + 1
+    if end < len(data):
+        # Torn last line after a crash: the upload was never acknowledged. Drop it so the
+        # next append does not get glued onto it.
+        with JOURNAL_PATH.open("r+b") as fh:
+            fh.truncate(offset + end)
+            fh.flush()
+            os.fsync(fh.fileno())
+    entries: list[dict[str, Any]] = []
+    for line in data[:end].decode("utf-8").splitlines():
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(entry, dict):
+            entries.append(entry)
+    return entries, offset + end
+
+
+def _stored_journal_offset(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT value FROM meta WHERE key = 'journal_offset'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def _journal_offset(conn: sqlite3.Connection) -> int:
+    offset = _stored_journal_offset(conn)
+    try:
+        size = JOURNAL_PATH.stat().st_size
+    except FileNotFoundError:
+        return 0
+    # A journal shorter than the offset was truncated outside a compaction: replay it whole.
+    return offset if offset <= size else 0
+
+
+def _set_journal_offset(conn: sqlite3.Connection, offset: int) -> None:
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('journal_offset', ?)", (str(offset),))
+
+
+def _replay_journal(conn: sqlite3.Connection) -> bool:
+    # Only entries past the stored offset are replayed; the offset moves in the same
+    # transaction as the rows, so an entry whose commit never landed is picked up next time.
+    # Idempotent: adds already in the catalog are ignored through record_id, updates rewrite the row.
+    # Returns whether any row actually changed.
+    entries, offset = _read_journal(_journal_offset(conn))
+    if offset != _stored_journal_offset(conn):
+        _set_journal_offset(conn, offset)
+    before = conn.total_changes
+    for entry in entries:
+        record = entry.get("record")
+        if not isinstance(record, dict):
+            continue
+        if entry.get("op") == "add":
+            _insert_records(conn, [record])
+        elif entry.get("op") == "update":
+            _update_records(conn, [record])
+    return conn.total_changes != before
+
+
+def _journal_append(entries: list[dict[str, Any]]) -> None:
+    data = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries)
+    with JOURNAL_PATH.open("a", encoding="utf-8") as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+def _write_snapshot(items: list[dict[str, Any]]) -> None:
+    tmp_path = HISTORY_PATH.with_suffix(".json.tmp")
+    with tmp_path.open("w", encoding="utf-8") as fh:
+        json.dump({"version": 1, "items": items}, fh, ensure_ascii=False, indent=2)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, HISTORY_PATH)
+
+
+def _record_id(record: dict[str, Any]) -> str:
+    rid = record.get("record_id")
+    if rid:
+        return str(rid)
+    # Legacy history.json items have no id: derive a stable one so replays stay idempotent.
+    digest = hashlib.sha1(json.dumps(record, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _insert_records(conn: sqlite3.Connection, records: list[dict[str, Any]]) -> None:
+    rows = []
+    for r in records:
+        r = {**r, "record_id": _record_id(r)}
+        rows.append(
+            (
+                r["record_id"],
+                str(r.get("kind", "")),
+                str(r.get("frequency") or ""),
+                str(r.get("date_key") or ""),
+                str(r.get("uploaded_at") or ""),
+                json.dumps(r, ensure_ascii=False),
+            )
+        )
+    conn.executemany(
+        "INSERT OR IGNORE INTO items (record_id, kind, frequency, date_key, uploaded_at, payload) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+
+
+def _update_records(conn: sqlite3.Connection, records: list[dict[str, Any]]) -> None:
+    payloads = [(r, json.dumps(r, ensure_ascii=False)) for r in records]
+    conn.executemany(
+        "UPDATE items SET uploaded_at = ?, payload = ? WHERE record_id = ? AND payload != ?",
+        [(str(r.get("uploaded_at") or ""), payload, _record_id(r), payload) for r, payload in payloads],
+    )
+
+
+def _bump_version(conn: sqlite3.Connection) -> None:
+    # Called inside the writing transaction, so readers never see new rows under an old version.
+    conn.execute(
+        "INSERT INTO meta (key, value) VALUES ('version', '1') "
+        "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+    )
+
+
+def _read_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def _history_token() -> tuple[Any, ...]:
+    # One connection per thread: checking the catalog version is then a single indexed read.
+    conn = getattr(_reader, "conn", None)
+    if conn is None:
+        conn = _reader.conn = sqlite3.connect(CATALOG_PATH, timeout=30, check_same_thread=False)
+    return (_read_version(conn),)
+
+
+def _history_index() -> dict[str, Any]:
+    global _index
+    _ensure_catalog()
+    token = _history_token()
+    index = _index
+    if index is not None and index["token"] == token:
+        return index
+    with _index_lock:
+        if _index is not None and _index["token"] == token:
+            return _index
+        with closing(_connect()) as conn:
+            # Version and rows are read from the same snapshot of the catalog.
+            conn.execute("BEGIN")
+            token = (_read_version(conn),)
+            rows = conn.execute("SELECT payload FROM items ORDER BY uploaded_at DESC, id ASC").fetchall()
+            conn.rollback()
+
+        by_kind: dict[str, list[dict[str, Any]]] = {}
+        by_kind_date: dict[str, dict[str, list[dict[str, Any]]]] = {}
+        by_frequency: dict[tuple[str, str], list[dict[str, Any]]] = {}
+        by_date: dict[tuple[str, str], dict[str, list[dict[str, Any]]]] = {}
+        for (payload,) in rows:
+            record = json.loads(payload)
+            kind = str(record.get("kind", ""))
+            key = (kind, str(record.get("frequency") or ""))
+            by_kind.setdefault(kind, []).append(record)
+            by_kind_date.setdefault(kind, {}).setdefault(str(record.get("date_key") or ""), []).append(record)
+            by_frequency.setdefault(key, []).append(record)
+            by_date.setdefault(key, {}).setdefault(str(record.get("date_key") or ""), []).append(record)
+
+        _index = {
+            "token": token,
+            "by_kind": by_kind,
+            "by_kind_date": by_kind_date,
+            "by_frequency": by_frequency,
+            "by_date": by_date,
+            "dates": {key: _sort_date_keys([d for d in groups if d]) for key, groups in by_date.items()},
+        }
+        return _index
+
+
+def _indexed_records(kind: str, frequency: str | None, date_key: str | None) -> list[dict[str, Any]]:
+    index = _history_index()
+    if frequency is None:
+        if date_key is None:
+            return list(index["by_kind"].get(kind, []))
+        return list(index["by_kind_date"].get(kind, {}).get(date_key, []))
+    if date_key is None:
+        return list(index["by_frequency"].get((kind, frequency), []))
+    return list(index["by_date"].get((kind, frequency), {}).get(date_key, []))
+
+
+def _indexed_summary(kind: str) -> list[tuple[str, str, int]]:
+    index = _history_index()
+    return [
+        (frequency, date_key, len(records))
+        for (k, frequency), groups in index["by_date"].items()
+        if k == kind
+        for date_key, records in groups.items()
+    ]
+
+
+def load_history() -> dict[str, Any]:
+    _ensure_catalog()
+    with closing(_connect()) as conn:
+        rows = conn.execute("SELECT payload FROM items ORDER BY id").fetchall()
+    return {"version": 1, "items": [json.loads(r[0]) for r in rows]}
 
 
 def save_history(history: dict[str, Any]) -> None:
-    BASE_DATA_DIR.mkdir(parents=True, exist_ok=True)
-    ASFIM_BASE_DIR.mkdir(parents=True, exist_ok=True)
-    BAM_BASE_DIR.mkdir(parents=True, exist_ok=True)
-    DB_DIR.mkdir(parents=True, exist_ok=True)
-    for folder in ASFIM_DIRS.values():
-        folder.mkdir(parents=True, exist_ok=True)
-    HISTORY_PATH.write_text(json.dumps(history, ensure_ascii=False, indent=2), encoding="utf-8")
+    _ensure_catalog()
+    items = history.get("items", [])
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM items")
+            _insert_records(conn, [i for i in items if isinstance(i, dict)])
+            _bump_version(conn)
+            _compact_locked(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def compact_history() -> None:
+    """Fold the journal into the history.json snapshot and truncate it."""
+    _ensure_catalog()
+    with closing(_connect()) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _compact_locked(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def _compact_locked(conn: sqlite3.Connection) -> None:
+    # Caller holds the catalog write lock, so no upload can append in between.
+    rows = conn.execute("SELECT payload FROM items ORDER BY id").fetchall()
+    _write_snapshot([json.loads(r[0]) for r in rows])
+    with JOURNAL_PATH.open("w", encoding="utf-8") as fh:
+        fh.flush()
+        os.fsync(fh.fileno())
+    _set_journal_offset(conn, 0)
+
+
+def _commit_records(added: list[dict[str, Any]], updated: list[dict[str, Any]]) -> None:
+    if not added and not updated:
+        return
+    _ensure_catalog()
+    with closing(_connect()) as conn:
+        # The write lock orders journal appends with compaction across sessions.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _replay_journal(conn)
+            _journal_append(
+                [{"op": "add", "record": r} for r in added] + [{"op": "update", "record": r} for r in updated]
+            )
+            _insert_records(conn, added)
+            _update_records(conn, updated)
+            _set_journal_offset(conn, JOURNAL_PATH.stat().st_size)
+            _bump_version(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if JOURNAL_PATH.stat().st_size >= JOURNAL_COMPACT_BYTES:
+        compact_history()
 
 
 def _normalize_frequency(frequency: str) -> str:
@@ -77,14 +472,29 @@ def _sanitize_filename(filename: str) -> str:
     return safe.strip("_") or "asfim.xlsx"
 
 
+DATE_KEY_FORMATS = ("%Y-%m-%d", "%Y_%m_%d", "%d-%m-%Y", "%d_%m_%Y")
+
+
+def parse_date_key(key: str) -> datetime | None:
+    """Date of a catalog date key, in any of the formats batch dates are accepted in."""
+    for fmt in DATE_KEY_FORMATS:
+        try:
+            return datetime.strptime(key, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def date_key_order(key: str) -> tuple[int, datetime, str]:
+    """Ascending sort key for date keys: the reverse of _sort_date_keys, undated keys first."""
+    parsed = parse_date_key(key)
+    return (0, datetime.min, key) if parsed is None else (1, parsed, key)
+
+
 def _sort_date_keys(keys: list[str]) -> list[str]:
     def parse_key(k: str) -> tuple[int, datetime | None, str]:
-        for fmt in ("%Y-%m-%d", "%Y_%m_%d", "%d-%m-%Y", "%d_%m_%Y"):
-            try:
-                return (0, datetime.strptime(k, fmt), k)
-            except ValueError:
-                continue
-        return (1, None, k)
+        parsed = parse_date_key(k)
+        return (1, None, k) if parsed is None else (0, parsed, k)
 
     parsed = [parse_key(k) for k in keys]
     dated = sorted([p for p in parsed if p[0] == 0], key=lambda x: x[1], reverse=True)
@@ -112,218 +522,270 @@ def _extract_date_from_filename(filename: str) -> str | None:
     return None
 
 
-def _extract_date_from_content(file_bytes: bytes) -> str | None:
-    wb = None
-    try:
-        from io import BytesIO
-
-        wb = load_workbook(BytesIO(file_bytes), read_only=True, data_only=True)
-        ws = wb[wb.sheetnames[0]]
-        max_rows = min(6, ws.max_row)
-        for row_idx in range(1, max_rows + 1):
-            values = ws[row_idx]
-            text = " ".join(str(c.value) for c in values if c.value is not None)
-            match = re.search(r"(\d{2}[/-]\d{2}[/-]\d{4})", text)
-            if match:
-                raw = match.group(1).replace("-", "/")
-                parsed = datetime.strptime(raw, "%d/%m/%Y")
-                return parsed.strftime("%Y-%m-%d")
-    except Exception:
-        return None
-    finally:
-        try:
-            if wb is not None:
-                wb.close()
-        except Exception:
-            pass
+def _resolve_date_key(
+    filename: str,
+    sniff: WorkbookSniff,
+    batch_date_key: str | None = None,
+    kind: str = "asfim",
+) -> tuple[str | None, str]:
+    date_from_content = sniff.content_date
+    if kind == "bam":
+        date_from_content = sniff.bam_value_date or date_from_content
+    if date_from_content:
+        return date_from_content, "contenu"
 
-    return None
+    date_from_filename = _extract_date_from_filename(filename)
+    if date_from_filename:
+        return date_from_filename, "nom_fichier"
 
+    if batch_date_key:
+        return _sanitize_date_key(batch_date_key), "date_lot"
 
-def _extract_date_from_text(text: str) -> str | None:
-    if not text:
-        return None
-    m1 = re.search(r"(\d{2}[/-]\d{2}[/-]\d{4})", text)
-    if m1:
-        raw = m1.group(1).replace("-", "/")
-        try:
-            return datetime.strptime(raw, "%d/%m/%Y").strftime("%Y-%m-%d")
-        except ValueError:
-            pass
-    m2 = re.search(r"(\d{4}-\d{2}-\d{2})", text)
-    if m2:
-        try:
-            return datetime.strptime(m2.group(1), "%Y-%m-%d").strftime("%Y-%m-%d")
-        except ValueError:
-            pass
-    return None
+    return None, "manquante"
 
 
-def _extract_bam_date_from_content(file_bytes: bytes) -> str | None:
-    wb = None
-    try:
-        from io import BytesIO
-
-        wb = load_workbook(BytesIO(file_bytes), read_only=True, data_only=True)
-        ws = wb[wb.sheetnames[0]]
-
-        header_row = None
-        date_col = None
-        for r in range(1, min(15, ws.max_row) + 1):
-            row_vals = ["" if c.value is None else str(c.value) for c in ws[r]]
-            for i, v in enumerate(row_vals, start=1):
-                norm = v.strip().lower()
-                if norm in {"date de la valeur", "date de valeur"}:
-                    header_row = r
-                    date_col = i
-                    break
-            if header_row:
-                break
-
-        if header_row and date_col:
-            counts: dict[str, int] = {}
-            for r in range(header_row + 1, min(ws.max_row, header_row + 300) + 1):
-                val = ws.cell(row=r, column=date_col).value
-                parsed = _extract_date_from_text("" if val is None else str(val))
-                if parsed:
-                    counts[parsed] = counts.get(parsed, 0) + 1
-            if counts:
-                return sorted(counts.items(), key=lambda x: (-x[1], x[0]))[0][0]
-
-        for r in range(1, min(8, ws.max_row) + 1):
-            text = " ".join("" if c.value is None else str(c.value) for c in ws[r])
-            parsed = _extract_date_from_text(text)
-            if parsed:
-                return parsed
-    except Exception:
-        return None
-    finally:
+def _prepare_upload(
+    filename: str,
+    data: bytes,
+    kind: str,
+    frequency: str,
+    batch_date_key: str | None,
+) -> tuple[str | None, str, dict[str, Any] | None, str]:
+    # Runs in a worker process for bulk uploads; the only side effect is the content-addressed ASFIM table.
+    sniff = sniff_workbook(data, kind=kind, frequency=frequency or None)
+    date_key, source = _resolve_date_key(filename, sniff, batch_date_key=batch_date_key, kind=kind)
+    content_hash = _sha256(data)
+    layout = sniff.layout()
+    if kind == "asfim" and date_key and not _asfim_table_path(content_hash, frequency).exists():
         try:
-            if wb is not None:
-                wb.close()
+            _write_asfim_table(content_hash, frequency, parse_asfim_workbook(data, frequency, layout))
         except Exception:
+            # Unreadable workbooks are still archived; readers retry the parse on demand.
             pass
-    return None
+    return date_key, source, layout, content_hash
+
+
+def _prepare_uploads(
+    uploads: list[tuple[str, bytes]],
+    kind: str,
+    frequency: str,
+    batch_date_key: str | None,
+    max_workers: int | None = None,
+) -> list[tuple[str | None, str, dict[str, Any] | None, str]]:
+    names = [name for name, _ in uploads]
+    payloads = [data for _, data in uploads]
+    n = len(uploads)
+    args = (names, payloads, [kind] * n, [frequency] * n, [batch_date_key] * n)
+    if n < PARALLEL_INGEST_MIN_FILES or max_workers == 1:
+        return list(map(_prepare_upload, *args))
+    workers = min(n, max_workers or os.cpu_count() or 1)
+    # Spawned, not forked: a fork of the multithreaded Streamlit server can inherit a lock
+    # another thread holds. Workers start on submit, so all of them start with __main__ hidden.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        with _main_hidden():
+            futures = [pool.submit(_prepare_upload, *task) for task in zip(*args)]
+        return [future.result() for future in futures]
+
+
+@contextmanager
+def _main_hidden() -> Iterator[None]:
+    """Keep spawned processes from re-running __main__, which under Streamlit is the app script."""
+    main = sys.modules["__main__"]
+    blank = types.ModuleType("__main__")
+    sys.modules["__main__"] = blank
+    try:
+        yield
+    finally:
+        # A rerun started meanwhile installs its own script module; leave that one in place.
+        if sys.modules.get("__main__") is blank:
+            sys.modules["__main__"] = main
 
 
-def _resolve_date_key(uploaded_file, batch_date_key: str | None = None, kind: str = "asfim") -> tuple[str | None, str]:
-    date_from_content = _extract_date_from_content(uploaded_file.getvalue())
-    if kind == "bam":
-        date_from_content = _extract_bam_date_from_content(uploaded_file.getvalue()) or date_from_content
-    if date_from_content:
-        return date_from_content, "contenu"
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
 
-    date_from_filename = _extract_date_from_filename(uploaded_file.name)
-    if date_from_filename:
-        return date_from_filename, "nom_fichier"
 
-    if batch_date_key:
-        return _sanitize_date_key(batch_date_key), "date_lot"
+def _blob_path(content_hash: str) -> Path:
+    return BLOB_DIR / content_hash[:2] / f"{content_hash}.xlsx"
 
-    return None, "manquante"
 
+def _write_blob(content_hash: str, data: bytes) -> Path:
+    path = _blob_path(content_hash)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    return path
 
-def _build_storage_path(frequency: str, date_key: str, original_filename: str) -> Path:
-    folder = ASFIM_DIRS[frequency]
-    return _build_storage_path_in_folder(folder, date_key, original_filename)
 
+def _asfim_table_path(content_hash: str, frequency: str) -> Path:
+    return BLOB_DIR / content_hash[:2] / f"{content_hash}.{frequency}.v{ASFIM_SCHEMA_VERSION}.parquet"
+
+
+def _write_asfim_table(content_hash: str, frequency: str, table: pd.DataFrame) -> Path:
+    path = _asfim_table_path(content_hash, frequency)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    table.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+    for stale in path.parent.glob(f"{content_hash}.{frequency}.v*.parquet"):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+    return path
+
+
+def load_asfim_table(
+    storage_path: str,
+    frequency: str,
+    content_hash: str | None = None,
+    layout: dict[str, Any] | None = None,
+) -> pd.DataFrame:
+    """Parsed ASFIM table from its columnar copy; the workbook is only parsed when that copy is missing or stale."""
+    frequency = _normalize_frequency(frequency)
+    path = _asfim_table_path(content_hash, frequency) if content_hash else None
+    if path is not None and path.exists():
+        try:
+            return pd.read_parquet(path)
+        except (OSError, ValueError):
+            pass
+
+    table = parse_asfim_workbook(storage_path, frequency, layout)
+    if content_hash:
+        try:
+            _write_asfim_table(content_hash, frequency, table)
+        except OSError:
+            pass
+    return table
 
-def _build_storage_path_in_folder(folder: Path, date_key: str, original_filename: str) -> Path:
+
+def record_content_hash(record: dict[str, Any]) -> str | None:
+    """SHA-256 of the stored workbook; hashed once from disk for records predating sha256."""
+    known = record.get("sha256")
+    if known:
+        return str(known)
+    path = Path(str(record.get("storage_path", "")))
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _hash_memo:
+        _hash_memo[key] = _sha256(path.read_bytes())
+    return _hash_memo[key]
+
+
+def _stage_upload(
+    pending: dict[str, tuple[str, dict[str, Any]]],
+    kind: str,
+    frequency: str,
+    date_key: str,
+    original_filename: str,
+    data: bytes,
+    source: str,
+    layout: dict[str, Any] | None = None,
+    content_hash: str | None = None,
+) -> dict[str, Any]:
+    content_hash = content_hash or _sha256(data)
     safe_date = _sanitize_date_key(date_key)
-    safe_name = _sanitize_filename(original_filename)
+    now = datetime.now().isoformat(timespec="seconds")
 
-    candidate = folder / f"{safe_date}__{safe_name}"
-    if not candidate.exists():
-        return candidate
+    staged = [rec for _, rec in pending.values() if rec["kind"] == kind and rec["date_key"] == safe_date]
+    for existing in staged + _indexed_records(kind, frequency, safe_date):
+        if (existing.get("frequency") or "") != frequency or record_content_hash(existing) != content_hash:
+            continue
+        if not Path(str(existing.get("storage_path", ""))).exists():
+            continue
+        # Identical re-upload: keep the stored blob, only refresh the metadata.
+        refreshed = {
+            **existing,
+            "original_filename": original_filename,
+            "sha256": content_hash,
+            "uploaded_at": now,
+            "date_source": source,
+        }
+        if layout and not refreshed.get("layout"):
+            refreshed["layout"] = layout
+        op = pending.get(refreshed["record_id"], ("update", refreshed))[0]
+        pending[refreshed["record_id"]] = (op, refreshed)
+        return {**refreshed, "deduplicated": True}
+
+    blob = _write_blob(content_hash, data)
+    record: dict[str, Any] = {"record_id": uuid.uuid4().hex, "kind": kind}
+    if frequency:
+        record["frequency"] = frequency
+    record.update(
+        {
+            "date_key": safe_date,
+            "filename": f"{safe_date}__{_sanitize_filename(original_filename)}",
+            "original_filename": original_filename,
+            "storage_path": str(blob.as_posix()),
+            "sha256": content_hash,
+            "uploaded_at": now,
+            "date_source": source,
+        }
+    )
+    if layout:
+        # Header layout found while sniffing; the parser reuses it instead of re-detecting.
+        record["layout"] = layout
+    pending[record["record_id"]] = ("add", record)
+    return record
 
-    stem = candidate.stem
-    suffix = candidate.suffix or ".xlsx"
-    version = 2
-    while True:
-        versioned = folder / f"{stem}_v{version}{suffix}"
-        if not versioned.exists():
-            return versioned
-        version += 1
 
+def _commit_staged(pending: dict[str, tuple[str, dict[str, Any]]]) -> None:
+    _commit_records(
+        [rec for op, rec in pending.values() if op == "add"],
+        [rec for op, rec in pending.values() if op == "update"],
+    )
 
-def add_asfim_files(files, frequency: str, batch_date_key: str | None = None) -> dict[str, Any]:
+
+def add_asfim_files(
+    files,
+    frequency: str,
+    batch_date_key: str | None = None,
+    max_workers: int | None = None,
+) -> dict[str, Any]:
     init_storage()
     normalized_frequency = _normalize_frequency(frequency)
 
-    history = load_history()
-    items: list[dict[str, Any]] = history.get("items", [])
-
     results = {"saved": [], "errors": []}
-    for f in files:
-        resolved_date_key, source = _resolve_date_key(f, batch_date_key=batch_date_key, kind="asfim")
+    pending: dict[str, tuple[str, dict[str, Any]]] = {}
+    uploads = [(f.name, f.getvalue()) for f in files]
+    prepared = _prepare_uploads(uploads, "asfim", normalized_frequency, batch_date_key, max_workers)
+    for (name, data), (resolved_date_key, source, layout, content_hash) in zip(uploads, prepared):
         if not resolved_date_key:
             results["errors"].append(
                 {
-                    "filename": f.name,
+                    "filename": name,
                     "error": "Impossible de déterminer date_key (contenu/nom/date lot).",
                 }
             )
             continue
 
-        target_path = _build_storage_path(normalized_frequency, resolved_date_key, f.name)
-        target_path.write_bytes(f.getvalue())
-
-        record = {
-            "kind": "asfim",
-            "frequency": normalized_frequency,
-            "date_key": _sanitize_date_key(resolved_date_key),
-            "filename": target_path.name,
-            "original_filename": f.name,
-            "storage_path": str(target_path.as_posix()),
-            "uploaded_at": datetime.now().isoformat(timespec="seconds"),
-            "date_source": source,
-        }
-        items.append(record)
+        record = _stage_upload(
+            pending, "asfim", normalized_frequency, resolved_date_key, name, data, source, layout, content_hash
+        )
         results["saved"].append(record)
 
-    history["items"] = items
-    save_history(history)
+    _commit_staged(pending)
     return results
 
 
 def list_asfim_dates(frequency: str) -> list[str]:
     normalized_frequency = _normalize_frequency(frequency)
-    items = load_history().get("items", [])
-    dates = sorted(
-        {
-            str(item.get("date_key", ""))
-            for item in items
-            if item.get("kind") == "asfim" and item.get("frequency") == normalized_frequency and item.get("date_key")
-        }
-    )
-    return _sort_date_keys(dates)
+    return list(_history_index()["dates"].get(("asfim", normalized_frequency), []))
 
 
 def list_asfim_files(frequency: str, date_key: str) -> list[dict[str, Any]]:
     normalized_frequency = _normalize_frequency(frequency)
     normalized_date_key = _sanitize_date_key(date_key)
-    items = load_history().get("items", [])
-    out = [
-        item
-        for item in items
-        if item.get("kind") == "asfim"
-        and item.get("frequency") == normalized_frequency
-        and item.get("date_key") == normalized_date_key
-    ]
-    out.sort(key=lambda x: str(x.get("uploaded_at", "")), reverse=True)
-    return out
+    return _indexed_records("asfim", normalized_frequency, normalized_date_key)
 
 
 def summarize_asfim_history() -> list[dict[str, Any]]:
-    items = [i for i in load_history().get("items", []) if i.get("kind") == "asfim"]
-    summary: dict[tuple[str, str], int] = {}
-    for it in items:
-        key = (str(it.get("frequency", "")), str(it.get("date_key", "")))
-        summary[key] = summary.get(key, 0) + 1
-
     rows = [
         {"Type": freq, "Date": date_key, "Nombre de fichiers": count}
-        for (freq, date_key), count in summary.items()
+        for freq, date_key, count in _indexed_summary("asfim")
         if freq and date_key
     ]
 
@@ -332,84 +794,80 @@ def summarize_asfim_history() -> list[dict[str, Any]]:
 
 
 def get_asfim_records(frequency: str | None = None, date_key: str | None = None) -> list[dict[str, Any]]:
-    items = [i for i in load_history().get("items", []) if i.get("kind") == "asfim"]
-    if frequency:
-        normalized_frequency = _normalize_frequency(frequency)
-        items = [i for i in items if i.get("frequency") == normalized_frequency]
-    if date_key:
-        normalized_date = _sanitize_date_key(date_key)
-        items = [i for i in items if i.get("date_key") == normalized_date]
-    items.sort(key=lambda x: str(x.get("uploaded_at", "")), reverse=True)
-    return items
+    normalized_frequency = _normalize_frequency(frequency) if frequency else None
+    normalized_date = _sanitize_date_key(date_key) if date_key else None
+    return _indexed_records("asfim", normalized_frequency, normalized_date)
+
+
+def latest_asfim_record(frequency: str, date_key: str) -> dict[str, Any] | None:
+    for rec in get_asfim_records(frequency=frequency, date_key=date_key):
+        if Path(str(rec.get("storage_path", ""))).exists():
+            return rec
+    return None
+
 
+def history_version() -> tuple[Any, ...]:
+    """Changes whenever any process writes the catalog; cheap enough to check on every read."""
+    return _history_token()
 
-def add_bam_files(files, batch_date_key: str | None = None) -> dict[str, Any]:
+
+def add_bam_files(files, batch_date_key: str | None = None, max_workers: int | None = None) -> dict[str, Any]:
     init_storage()
-    history = load_history()
-    items: list[dict[str, Any]] = history.get("items", [])
     results = {"saved": [], "errors": []}
+    pending: dict[str, tuple[str, dict[str, Any]]] = {}
 
-    for f in files:
-        resolved_date_key, source = _resolve_date_key(f, batch_date_key=batch_date_key, kind="bam")
+    uploads = [(f.name, f.getvalue()) for f in files]
+    prepared = _prepare_uploads(uploads, "bam", "", batch_date_key, max_workers)
+    for (name, data), (resolved_date_key, source, _, content_hash) in zip(uploads, prepared):
         if not resolved_date_key:
             results["errors"].append(
                 {
-                    "filename": f.name,
+                    "filename": name,
                     "error": "Impossible de déterminer date_key BAM (contenu/nom/date lot).",
                 }
             )
             continue
 
-        target_path = _build_storage_path_in_folder(BAM_BASE_DIR, resolved_date_key, f.name)
-        target_path.write_bytes(f.getvalue())
-
-        record = {
-            "kind": "bam",
-            "date_key": _sanitize_date_key(resolved_date_key),
-            "filename": target_path.name,
-            "original_filename": f.name,
-            "storage_path": str(target_path.as_posix()),
-            "uploaded_at": datetime.now().isoformat(timespec="seconds"),
-            "date_source": source,
-        }
-        items.append(record)
+        record = _stage_upload(pending, "bam", "", resolved_date_key, name, data, source, content_hash=content_hash)
         results["saved"].append(record)
 
-    history["items"] = items
-    save_history(history)
+    _commit_staged(pending)
     return results
 
 
 def list_bam_dates() -> list[str]:
-    items = load_history().get("items", [])
-    dates = sorted({str(i.get("date_key", "")) for i in items if i.get("kind") == "bam" and i.get("date_key")})
-    return _sort_date_keys(dates)
+    return list(_history_index()["dates"].get(("bam", ""), []))
 
 
 def list_bam_files(date_key: str) -> list[dict[str, Any]]:
     normalized_date_key = _sanitize_date_key(date_key)
-    items = load_history().get("items", [])
-    out = [i for i in items if i.get("kind") == "bam" and i.get("date_key") == normalized_date_key]
-    out.sort(key=lambda x: str(x.get("uploaded_at", "")), reverse=True)
-    return out
+    return _indexed_records("bam", "", normalized_date_key)
 
 
 def summarize_bam_history() -> list[dict[str, Any]]:
-    items = [i for i in load_history().get("items", []) if i.get("kind") == "bam"]
-    summary: dict[str, int] = {}
-    for it in items:
-        date_key = str(it.get("date_key", ""))
-        if date_key:
-            summary[date_key] = summary.get(date_key, 0) + 1
-    rows = [{"Date": k, "Nombre de fichiers": v} for k, v in summary.items()]
+    rows = [{"Date": k, "Nombre de fichiers": v} for _, k, v in _indexed_summary("bam") if k]
     rows.sort(key=lambda r: r["Date"], reverse=True)
     return rows
 
 
 def get_bam_records(date_key: str | None = None) -> list[dict[str, Any]]:
-    items = [i for i in load_history().get("items", []) if i.get("kind") == "bam"]
-    if date_key:
-        normalized_date_key = _sanitize_date_key(date_key)
-        items = [i for i in items if i.get("date_key") == normalized_date_key]
-    items.sort(key=lambda x: str(x.get("uploaded_at", "")), reverse=True)
-    return items
+    normalized_date_key = _sanitize_date_key(date_key) if date_key else None
+    return _indexed_records("bam", "", normalized_date_key)
+
+
+def latest_bam_record(date_key: str) -> dict[str, Any] | None:
+    for rec in get_bam_records(date_key=date_key):
+        if Path(str(rec.get("storage_path", ""))).exists():
+            return rec
+    return None
+
+
+def bam_dates_since(mark: str) -> tuple[list[str], str]:
+    """Date keys of BAM uploads stamped at or after `mark`, and the latest stamp, for incremental readers."""
+    records = _history_index()["by_kind"].get("bam", [])
+    dates: list[str] = []
+    for rec in records:
+        if str(rec.get("uploaded_at") or "") < mark:
+            break
+        dates.append(str(rec.get("date_key") or ""))
+    return dates, str(records[0].get("uploaded_at") or "") if records else mark
@@ -1,8 +1,13 @@
 ﻿from __future__ import annotations
 
+import threading
+from bisect import bisect_left
 from dataclasses import dataclass
-from datetime import date, timedelta
-from typing import Sequence
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Any, Callable, Mapping, Sequence
+
+import numpy as np
 
 
 def DateSerial(y: int, m: int, d: int) -> date:
@@ -37,6 +42,90 @@ def _clean_curve_points(mt: Sequence[int | float], tx: Sequence[int | float]) ->
     return mt_nz, tx_nz
 
 
+class YieldCurve:
+    """calcul_taux for one curve, with the cleaned points and the pivot prepared once.
+
+    Brackets are found by bisection, which matches the VBA forward scan when maturities are
+    strictly increasing (`from_points` returns None otherwise). The bracket straddling the
+    pivot is the only one needing a rate conversion; its equivalent rates are computed here
+    with Python's pow, so `rate` and `evaluate` return exactly what calcul_taux does.
+    """
+
+    def __init__(self, mt: Sequence[int], tx: Sequence[float], C1_date: date, pivot: int) -> None:
+        self.mt = list(mt)
+        self.tx = list(tx)
+        self.C1_date = C1_date
+        self.pivot = pivot
+        self.mt_arr = np.asarray(self.mt, dtype="float64")
+        self.tx_arr = np.asarray(self.tx, dtype="float64")
+        # Index i of the bracket (mt[i], mt[i + 1]] with mt[i] <= pivot < mt[i + 1], if any.
+        self.cross = None
+        self.equiv_actu = self.equiv_mm = 0.0
+        i = bisect_left(self.mt, pivot + 1) - 1
+        if 0 <= i < len(self.mt) - 1:
+            self.cross = i
+            B, A = self.mt[i], self.mt[i + 1]
+            di = C1_date + timedelta(days=B)
+            Base = (di - DateSerial(di.year - 1, di.month, di.day)).days
+            self.equiv_actu = ((1 + self.tx[i] * B / 360.0) ** (Base / B)) - 1
+            di1 = C1_date + timedelta(days=A)
+            Base = (di1 - DateSerial(di1.year - 1, di1.month, di1.day)).days
+            self.equiv_mm = (360.0 / A) * (((1 + self.tx[i + 1]) ** (A / Base)) - 1)
+
+    @classmethod
+    def from_points(
+        cls,
+        mt: Sequence[int | float],
+        tx: Sequence[int | float],
+        C1_date: date,
+        mati_threshold_days: int | None = None,
+    ) -> YieldCurve | None:
+        mt_nz, tx_nz = _clean_curve_points(mt, tx)
+        if not mt_nz:
+            raise ValueError("mt is empty / no valid maturities")
+        if any(b <= a for a, b in zip(mt_nz, mt_nz[1:])):
+            return None
+        return cls(mt_nz, tx_nz, C1_date, mati(C1_date, 1, mati_threshold_days))
+
+    def rate(self, maturity: int) -> float:
+        mt, tx = self.mt, self.tx
+        if len(mt) == 1 or maturity <= mt[0]:
+            return tx[0]
+        if maturity > mt[-1]:
+            return ((maturity - mt[-2]) * (tx[-1] - tx[-2]) / (mt[-1] - mt[-2])) + tx[-2]
+        i = bisect_left(mt, maturity) - 1
+        A, B = mt[i + 1], mt[i]
+        if i == self.cross:
+            if maturity > self.pivot:
+                return ((maturity - B) * (tx[i + 1] - self.equiv_actu) / (A - B)) + self.equiv_actu
+            return ((maturity - B) * (self.equiv_mm - tx[i]) / (A - B)) + tx[i]
+        return ((maturity - B) * (tx[i + 1] - tx[i]) / (A - B)) + tx[i]
+
+    def evaluate(self, maturities: np.ndarray) -> np.ndarray:
+        m = np.asarray(maturities, dtype="float64")
+        mt, tx = self.mt_arr, self.tx_arr
+        if len(mt) == 1:
+            return np.full(m.shape, tx[0])
+        i = np.clip(np.searchsorted(mt, m, side="left") - 1, 0, len(mt) - 2)
+        A, B = mt[i + 1], mt[i]
+        lo, hi = tx[i], tx[i + 1]
+        if self.cross is not None:
+            at_cross = (i == self.cross) & (m <= mt[-1])
+            above = at_cross & (m > self.pivot)
+            lo = np.where(above, self.equiv_actu, lo)
+            hi = np.where(at_cross & ~above, self.equiv_mm, hi)
+        out = ((m - B) * (hi - lo) / (A - B)) + lo
+        out[m <= mt[0]] = tx[0]
+        return out
+
+
+@lru_cache(maxsize=64)
+def _cached_curve(
+    mt: tuple[int | float, ...], tx: tuple[int | float, ...], C1_date: date, mati_threshold_days: int | None
+) -> YieldCurve | None:
+    return YieldCurve.from_points(mt, tx, C1_date, mati_threshold_days)
+
+
 def calcul_taux(
     maturity: int,
     mt: Sequence[int | float],
@@ -45,6 +134,20 @@ def calcul_taux(
     mati_threshold_days: int | None = None,
 ) -> float:
     """Reproduce VBA calcul_taux structure and equations."""
+    curve = _cached_curve(tuple(mt), tuple(tx), C1_date, mati_threshold_days)
+    if curve is not None:
+        return curve.rate(maturity)
+    return _calcul_taux_scan(maturity, mt, tx, C1_date, mati_threshold_days)
+
+
+def _calcul_taux_scan(
+    maturity: int,
+    mt: Sequence[int | float],
+    tx: Sequence[int | float],
+    C1_date: date,
+    mati_threshold_days: int | None = None,
+) -> float:
+    # Literal VBA scan, kept for curves whose maturities are not strictly increasing.
     mt_nz, tx_nz = _clean_curve_points(mt, tx)
     d = len(mt_nz)
     if d == 0:
@@ -106,6 +209,53 @@ def cpz(maturity: int, duree: int, taux: Sequence[float]) -> float:
     return tzc[n - 2]
 
 
+def _bootstrap_step(rate: float, powers: Sequence[float]) -> float:
+    # One cpz year over the cached (1 + tzc[i - 1]) ** i, summed in cpz's order.
+    somme = 0.0
+    for p in powers:
+        somme += rate / p
+    return (((1.0 + rate) / (1.0 - somme)) ** (1.0 / (len(powers) + 1))) - 1.0
+
+
+def bootstrap_zero_coupon(taux: Sequence[float]) -> list[float]:
+    """Zero-coupon rate of every year of `taux` in one pass; element n - 1 equals cpz(_, n, taux).
+
+    Each (1 + tzc) ** i is computed once and reused by the later years, so the pass takes n
+    powers instead of cpz's n² / 2. The sums stay quadratic: each year re-adds rate / power
+    in cpz's order, which is what keeps cpz's exact results. Only the batch version carries
+    a running sum, at the cost of that exactness.
+    """
+    tzc: list[float] = []
+    powers: list[float] = []
+    for n, rate in enumerate(taux, start=1):
+        rate = float(rate)
+        tzc.append(rate if n == 1 else _bootstrap_step(rate, powers))
+        powers.append((1.0 + tzc[-1]) ** n)
+    return tzc
+
+
+def bootstrap_zero_coupon_batch(taux: np.ndarray) -> np.ndarray:
+    """bootstrap_zero_coupon for many curves at once, one per row, in O(years) array steps.
+
+    The discount sum Σ (1 + tzc[i - 1]) ** -i is carried forward and the year's rate factored
+    out of it. That and NumPy's pow move results by up to ~1e-15 from cpz, so use it for
+    bulk analytics rather than where the VBA figures must be reproduced; where cpz turns
+    complex (the sum passes 1) this gives NaN.
+    """
+    taux = np.asarray(taux, dtype="float64")
+    tzc = np.empty_like(taux)
+    if taux.shape[-1] == 0:
+        return tzc
+    tzc[..., 0] = taux[..., 0]
+    discount = 1.0 / (1.0 + tzc[..., 0])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for n in range(2, taux.shape[-1] + 1):
+            rate = taux[..., n - 1]
+            tzc[..., n - 1] = ((1.0 + rate) / (1.0 - rate * discount)) ** (1.0 / n) - 1.0
+            discount = discount + (1.0 + tzc[..., n - 1]) ** -n
+    return tzc
+
+
 def interpol(arg: bool, maturity: int, mtz: Sequence[int], txz: Sequence[float]) -> float:
     """VBA interpol translation. Active branch in your file is arg=True."""
     if not mtz or not txz or len(mtz) != len(txz):
@@ -165,32 +315,70 @@ def calcul_zerocp(
     pivot = mati(C1_date, 1, mati_threshold_days)
     if maturity <= pivot:
         return conversion_actu_monnaitaire(False, maturity, date_flux, mt, tx, C1_date, mati_threshold_days)
-
-    # Build annual maturity ladder (1..30 years) as in VBA.
-    duree = [i + 1 for i in range(30)]
-    matu = [
-        (DateSerial(C1_date.year + d, C1_date.month, C1_date.day) - C1_date).days
-        for d in duree
-    ]
-
-    j = 0
-    A = matu[j + 1]
-    B = matu[j]
-    while maturity > A and j < len(matu) - 2:
-        B = A
-        j += 1
-        A = matu[j + 1]
-
-    tzc = [0.0] * 30
-    taux = [0.0] * 30
-    tzc[0] = conversion_actu_monnaitaire(False, pivot, date_flux, mt, tx, C1_date, mati_threshold_days)
-    taux[0] = tzc[0]
-
-    for k in range(1, j + 2):
-        taux[k] = calcul_taux(matu[k], mt, tx, C1_date, mati_threshold_days)
-        tzc[k] = cpz(matu[k], duree[k], taux)
-
-    return interpol(True, maturity, matu, tzc)
+    return _cached_ladder(tuple(mt), tuple(tx), C1_date, mati_threshold_days).zero_rate(maturity)
+
+
+class ZeroCouponLadder:
+    """Annual zero-coupon ladder (1..30 years) of calcul_zerocp for one curve and C1 date.
+
+    Rungs are bootstrapped in VBA order the first time a maturity needs them and kept, so
+    each later zero_rate is one bracket lookup and interpolation. Rungs not reached yet
+    stay 0.0, as in the VBA arrays; interpol never reads them.
+    """
+
+    def __init__(
+        self,
+        mt: Sequence[int | float],
+        tx: Sequence[int | float],
+        C1_date: date,
+        mati_threshold_days: int | None = None,
+    ) -> None:
+        self.mt = mt
+        self.tx = tx
+        self.C1_date = C1_date
+        self.mati_threshold_days = mati_threshold_days
+        self.pivot = mati(C1_date, 1, mati_threshold_days)
+        self.duree = [i + 1 for i in range(30)]
+        self.matu = [
+            (DateSerial(C1_date.year + d, C1_date.month, C1_date.day) - C1_date).days
+            for d in self.duree
+        ]
+        self.taux = [0.0] * 30
+        self.tzc = [0.0] * 30
+        self.built = 0
+        self._powers: list[float] = []
+        self._lock = threading.Lock()
+
+    def _extend(self, last: int) -> None:
+        with self._lock:
+            if self.built == 0:
+                # conversion_actu_monnaitaire ignores its date_flux argument.
+                self.tzc[0] = conversion_actu_monnaitaire(
+                    False, self.pivot, self.C1_date, self.mt, self.tx, self.C1_date, self.mati_threshold_days
+                )
+                self.taux[0] = self.tzc[0]
+                self._powers = [1.0 + self.tzc[0]]
+                self.built = 1
+            for k in range(self.built, last + 1):
+                # Carries cpz's bootstrap forward: equal to cpz(matu[k], duree[k], taux), one rung at a time.
+                self.taux[k] = calcul_taux(self.matu[k], self.mt, self.tx, self.C1_date, self.mati_threshold_days)
+                self.tzc[k] = _bootstrap_step(self.taux[k], self._powers)
+                self._powers.append((1.0 + self.tzc[k]) ** (k + 1))
+                self.built = k + 1
+
+    def zero_rate(self, maturity: int) -> float:
+        # Same bracket as the VBA scan: the first rung at or beyond maturity, capped at 30 years.
+        j = min(max(bisect_left(self.matu, maturity) - 1, 0), len(self.matu) - 2)
+        if self.built <= j + 1:
+            self._extend(j + 1)
+        return interpol(True, maturity, self.matu, self.tzc)
+
+
+@lru_cache(maxsize=64)
+def _cached_ladder(
+    mt: tuple[int | float, ...], tx: tuple[int | float, ...], C1_date: date, mati_threshold_days: int | None
+) -> ZeroCouponLadder:
+    return ZeroCouponLadder(mt, tx, C1_date, mati_threshold_days)
 
 
 def DatePr_Cp(datejouissance: date, datevaleur: date) -> date:
@@ -239,6 +427,24 @@ def prix_amortissable(
     if tx is None:
         tx = []
 
+    def zero_rate(maturity: int, date_flux: date) -> float:
+        return calcul_zerocp(maturity, date_flux, mt, tx, c1_date, mati_threshold_days)
+
+    return _price_amortissable(
+        date_valeur, date_emission, date_echeance, nominal, tf, spread, nbramort, zero_rate
+    )
+
+
+def _price_amortissable(
+    date_valeur: date,
+    date_emission: date,
+    date_echeance: date,
+    nominal: int,
+    tf: float,
+    spread: float,
+    nbramort: int,
+    zero_rate: Callable[[int, date], float],
+) -> AmortissableResult:
     datefl: list[date] = [date(1900, 1, 1)] * max(101, nbramort + 1)
     amort: list[float] = [0.0] * max(101, nbramort + 1)
     crd: list[float] = [0.0] * max(101, nbramort + 1)
@@ -266,9 +472,7 @@ def prix_amortissable(
         j += 1
 
     m0 = (datefl[j - 1] - date_valeur).days
-    tzcpp[j - 1] = (
-        round(calcul_zerocp(m0, datefl[j - 1], mt, tx, c1_date, mati_threshold_days), 5) + spread
-    )
+    tzcpp[j - 1] = round(zero_rate(m0, datefl[j - 1]), 5) + spread
     base0 = (datefl[j - 1] - DateSerial(datefl[j - 1].year - 1, datefl[j - 1].month, datefl[j - 1].day)).days
     fract[j - 1] = (datefl[j - 1] - date_valeur).days / base0
     fluxvl[j - 1] = (amort[j - 1] + cpn[j - 1]) / ((1 + tzcpp[j - 1]) ** fract[j - 1])
@@ -276,9 +480,7 @@ def prix_amortissable(
 
     for i in range(j, nbramort):
         m_i = (datefl[i] - date_valeur).days
-        tzcpp[i] = (
-            round(calcul_zerocp(m_i, datefl[i], mt, tx, c1_date, mati_threshold_days), 5) + spread
-        )
+        tzcpp[i] = round(zero_rate(m_i, datefl[i]), 5) + spread
         fract[i] = fract[i - 1] + 1
         fluxvl[i] = (amort[i] + cpn[i]) / ((1 + tzcpp[i]) ** fract[i])
         P += fluxvl[i]
@@ -291,3 +493,83 @@ def prix_amortissable(
         crd=crd[:nbramort],
         cpn=cpn[:nbramort],
     )
+
+
+BOND_FIELDS = (
+    "date_emission",
+    "date_echeance",
+    "date_jouissance",
+    "nominal",
+    "tf",
+    "spread",
+    "nbramort",
+)
+
+
+def _bond_value(value: Any) -> Any:
+    # Table rows carry NumPy scalars and Timestamps; the scalar pricer expects Python ones
+    # (np.float64 rounds differently under round(), a Timestamp never equals a date).
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def normalize_bond(bond: Mapping[str, Any]) -> dict[str, Any]:
+    """BOND_FIELDS of a table row as the Python dates and numbers prix_amortissable expects."""
+    return {name: _bond_value(bond[name]) for name in BOND_FIELDS if name in bond}
+
+
+def prix_amortissable_batch(
+    bonds: Sequence[Mapping[str, Any]],
+    date_valeur: date,
+    mt: Sequence[int | float],
+    tx: Sequence[int | float],
+    c1_date: date | None = None,
+    mati_threshold_days: int | None = None,
+) -> list[AmortissableResult]:
+    """prix_amortissable for every bond against one curve.
+
+    Each bond is a mapping with BOND_FIELDS (date_jouissance may be left out: like the VBA,
+    the pricer never reads it), e.g. the rows of `DataFrame.to_dict("records")`.
+
+    The curve, its zero-coupon ladder and the rate of each flow maturity are computed once
+    and shared by all bonds; prices stay those of the scalar function, to the last digit.
+    """
+    if c1_date is None:
+        c1_date = date_valeur
+    mt = tuple(mt)
+    tx = tuple(tx)
+    pivot = mati(c1_date, 1, mati_threshold_days)
+    rates: dict[int, float] = {}
+
+    def zero_rate(maturity: int, date_flux: date) -> float:
+        # Depends on the maturity alone: the conversion ignores date_flux.
+        rate = rates.get(maturity)
+        if rate is None:
+            if maturity <= pivot:
+                rate = conversion_actu_monnaitaire(False, maturity, date_flux, mt, tx, c1_date, mati_threshold_days)
+            else:
+                rate = _cached_ladder(mt, tx, c1_date, mati_threshold_days).zero_rate(maturity)
+            rates[maturity] = rate
+        return rate
+
+    results: list[AmortissableResult] = []
+    for bond in bonds:
+        values = normalize_bond(bond)
+        if values["nbramort"] <= 0:
+            raise ValueError("nbramort must be > 0")
+        results.append(
+            _price_amortissable(
+                date_valeur,
+                values["date_emission"],
+                values["date_echeance"],
+                values["nominal"],
+                values["tf"],
+                values["spread"],
+                values["nbramort"],
+                zero_rate,
+            )
+        )
+    return results